@@ -1,79 +1,202 @@
+import hmac
+import json
 import os
-import xml.etree.ElementTree as ET
-import requests
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import queue
+import threading
+import time
+from concurrent.futures import wait
+from dataclasses import asdict
+from functools import wraps
+from urllib.parse import quote
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify
 from dotenv import load_dotenv
 
+from admin.server import worker_threads
+from ecp import config as tv_config, metrics
+from ecp.catalog import DEFAULT_PER_PAGE, get_catalog_index
+from ecp.discovery import get_registry
+from ecp.dispatcher import get_dispatcher
+from ecp.health import get_health
+from ecp.poller import get_poller
+
 # Compute the absolute path to the .env file (one directory up)
 ENV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
 
+UNAVAILABLE = "unavailable"
+
+# How long a control API call waits for the TV, per command, before giving up on it.
+COMMAND_WAIT = 10
+
+# ECP commands the control API will forward; everything else is rejected.
+COMMANDS = ("keypress", "keydown", "keyup", "launch")
+
+# Seconds between keep-alive comments on an idle event stream.
+EVENT_KEEPALIVE = 15
+
+# Event streams end after this many seconds (browsers reconnect on their own),
+# so a forgotten tab doesn't hold one of the server's workers forever.
+EVENT_STREAM_LIFETIME = 300
+
+# Every open stream holds one of the server's workers, so only this many are
+# served at once, leaving the rest for pages, the API and /metrics. Streams
+# over the limit get a 503 and are asked to come back EVENT_RETRY seconds later.
+try:
+    EVENT_STREAMS = int(os.environ.get("ADMIN_EVENT_STREAMS", 0))
+except ValueError:
+    EVENT_STREAMS = 0
+if EVENT_STREAMS <= 0:
+    EVENT_STREAMS = max(1, worker_threads() // 4)
+EVENT_RETRY = 30
+_event_streams = threading.BoundedSemaphore(EVENT_STREAMS)
+
+env_file = tv_config.EnvFile(ENV_PATH)
+
 def load_env():
-    """Read the .env file and return a dict of key-value pairs."""
-    config = {}
-    if os.path.exists(ENV_PATH):
-        with open(ENV_PATH) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    if '=' in line:
-                        key, value = line.split('=', 1)
-                        config[key.strip()] = value.strip()
-    return config
+    """Return the .env file as a dict of key-value pairs (re-read only when it changes)."""
+    return env_file.load()
 
 def write_env(new_config):
-    """Write the key-value pairs in new_config to the .env file."""
-    with open(ENV_PATH, 'w') as f:
-        for key, value in new_config.items():
-            f.write(f"{key}={value}\n")
+    """Atomically write the key-value pairs in new_config to the .env file."""
+    env_file.write(new_config)
+
+def active_app_label(active):
+    """Text shown for an ActiveApp query result, or the exception it raised."""
+    if active is None or isinstance(active, Exception):
+        return UNAVAILABLE
+    return active.name or "No active app"
 
-def get_active_app(roku_ip):
+def configured_tvs(config):
     """
-    Query the Roku device for its active app.
-    Returns the app name or an error message.
+    Return the configured TVs (ecp.config.TV) and make sure the poller is watching them.
+    Each TV is followed through the SSDP device registry if DHCP has moved it.
     """
-    url = f"http://{roku_ip}:8060/query/active-app"
-    try:
-        response = requests.get(url, timeout=3)
-        if response.status_code == 200:
-            root = ET.fromstring(response.content)
-            app_elem = root.find('app')
-            if app_elem is not None:
-                return app_elem.text
-            else:
-                return "No active app"
-        else:
-            return f"Error: {response.status_code}"
-    except Exception as e:
-        return f"Error: {e}"
+    registry = get_registry()
+    registry.start()
+    tvs = tv_config.configured_tvs(config, registry)
+    get_poller().track("admin", [tv.ip for tv in tvs])
+    return tvs
 
-def get_apps(roku_ip):
+def cached_status(tvs):
     """
-    Query the Roku device for the list of installed apps.
-    Returns a list of dictionaries with 'id' and 'name' keys,
-    sorted alphabetically by app name.
+    Everything the admin page shows, read from the background poller's cache.
+    Makes no network calls; anything not (freshly) cached shows as unavailable.
+    The sidebar starts on the first page of the first TV's apps; the rest is
+    fetched from /api/apps as the user searches and pages.
     """
-    url = f"http://{roku_ip}:8060/query/apps"
-    try:
-        response = requests.get(url, timeout=3)
-        if response.status_code == 200:
-            root = ET.fromstring(response.content)
-            apps = []
-            for app in root.findall('app'):
-                app_id = app.attrib.get('id', 'N/A')
-                app_name = app.text or 'N/A'
-                apps.append({"id": app_id, "name": app_name})
-            # Sort apps alphabetically by app name (case-insensitive)
-            apps = sorted(apps, key=lambda x: x["name"].lower())
-            return apps
-        else:
-            return [{"error": f"HTTP {response.status_code}"}]
-    except Exception as e:
-        return [{"error": str(e)}]
+    return {
+        "tv_states": {tv.name: tv_state(tv) for tv in tvs},
+        "apps_page": app_page(tvs[0]) if tvs else None,
+    }
+
+def app_page(tv, query="", page=1, per_page=DEFAULT_PER_PAGE):
+    """One page of tv's app catalog as a JSON-ready dict, with the catalog's error if any."""
+    catalog, error = get_catalog_index().status(tv.ip)
+    result = {"tv": tv.name, "label": tv.label, "error": error, "fetched_at": None,
+              "query": query, "page": 1, "per_page": per_page, "pages": 1, "total": 0,
+              "apps": []}
+    if catalog is not None:
+        result.update(catalog.page(query, page, per_page), fetched_at=catalog.fetched_at)
+    return result
+
+def tv_state(tv):
+    """What the dashboard shows for one TV: its active app and whether it is answering."""
+    entry = get_poller().cache.get(tv.ip, "active_app")
+    return {
+        "tv": tv.name,
+        "ip": tv.ip,
+        "active_app": active_app_label(entry.value if entry is not None and entry.fresh else None),
+        "reachable": None if entry is None else entry.error is None,
+    }
+
+def sse_event(event, data):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Replace with a strong secret key
 
+@app.template_filter('timestamp')
+def format_timestamp(value):
+    """Render a Unix timestamp as local date and time."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(value)) if value else "never"
+
+def api_login_required(view):
+    """
+    Like the login redirect on admin(), but answers API clients with a JSON 401.
+    Scripts can send the admin password in an X-Admin-Password header instead of logging in.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        password = request.headers.get('X-Admin-Password')
+        if password is not None:
+            admin_password = load_env().get("ADMIN_PASSWORD", "admin")
+            if hmac.compare_digest(password.encode(), admin_password.encode()):
+                return view(*args, **kwargs)
+        elif session.get('logged_in'):
+            return view(*args, **kwargs)
+        return jsonify({"error": "login required"}), 401
+    return wrapped
+
+def resolve_target(tv_id):
+    """
+    The TVs a control API call is for: tv_id is a TV name (TV01), number (1),
+    IP address, or the name of a group (which may be "all"). Returns [] if unknown.
+    """
+    config = load_env()
+    tvs = configured_tvs(config)
+    groups = tv_config.tv_groups(config, tvs)
+    if tv_id.lower() in groups:
+        return [tv.ip for tv in groups[tv_id.lower()]]
+    tv = find_tv(tvs, tv_id)
+    return [tv.ip] if tv is not None else []
+
+def find_tv(tvs, tv_id):
+    """The TV in tvs named (TV01), numbered (1) or addressed by tv_id, or None."""
+    for tv in tvs:
+        if tv_id.upper() in (tv.name, str(tv.number), tv.configured_ip, tv.ip):
+            return tv
+    return None
+
+def command_path(command):
+    """
+    ECP path for one control API command, given as "keypress/Up" or {"keypress": "Up"}.
+    Raises ValueError for anything that isn't a keypress, keydown, keyup or launch.
+    """
+    if isinstance(command, dict) and len(command) == 1:
+        (name, arg), = command.items()
+    elif isinstance(command, str) and '/' in command:
+        name, arg = command.split('/', 1)
+    else:
+        raise ValueError(f"not a command: {command!r}")
+    if name not in COMMANDS or not isinstance(arg, (str, int)) or not str(arg):
+        raise ValueError(f"not a command: {command!r}")
+    return f"{name}/{quote(str(arg), safe='')}"
+
+def run_commands(tv_ips, paths):
+    """
+    Queue paths, in order, for every TV in tv_ips on the shared dispatcher and
+    wait for them. Returns a JSON response with each result's measured latency.
+    """
+    dispatcher = get_dispatcher()
+    start = time.monotonic()
+    submitted = [(tv_ip, path, dispatcher.submit(tv_ip, path))
+                 for path in paths for tv_ip in tv_ips]
+    wait([future for _, _, future in submitted], timeout=COMMAND_WAIT * len(paths))
+    results = []
+    for tv_ip, path, future in submitted:
+        if future.done():
+            results.append(future.result().to_json())
+        else:
+            results.append({"tv_ip": tv_ip, "path": path, "ok": False, "status": None,
+                            "error": "timed out waiting for the TV", "latency_ms": None})
+    ok = all(result["ok"] for result in results)
+    return jsonify({
+        "ok": ok,
+        "results": results,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+    }), 200 if ok else 502
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     config = load_env()
@@ -99,36 +222,184 @@ def admin():
         return redirect(url_for('login'))
     
     config = load_env()
-    tv1_ip = config.get("TV01_IP", "10.24.10.23")
-    tv2_ip = config.get("TV02_IP", "10.24.10.99")
-    
-    active_app_tv1 = get_active_app(tv1_ip)
-    active_app_tv2 = get_active_app(tv2_ip)
-    
-    # Retrieve the list of apps from TV01 using the /query/apps endpoint
-    apps = get_apps(tv1_ip)
+    tvs = configured_tvs(config)
     
     if request.method == 'POST':
-        config['TV01_IP'] = request.form.get('TV01_IP')
-        config['TV02_IP'] = request.form.get('TV02_IP')
+        for tv in tvs:
+            config[f'{tv.name}_IP'] = request.form.get(f'{tv.name}_IP', tv.configured_ip)
+        # A new TV can be added from the blank TVnn_IP field at the end of the form.
+        new_tv = request.form.get('NEW_TV_IP', '').strip()
+        if new_tv:
+            config[f'TV{(tvs[-1].number if tvs else 0) + 1:02d}_IP'] = new_tv
         config['APP1_ID'] = request.form.get('APP1_ID')
         config['APP2_ID'] = request.form.get('APP2_ID')
         config['APP3_ID'] = request.form.get('APP3_ID')
         config['APP4_ID'] = request.form.get('APP4_ID')
         config['ADMIN_PASSWORD'] = request.form.get('ADMIN_PASSWORD')
-        config['ICON_DIR'] = request.form.get('ICON_DIR')
+        # The form has no ICON_DIR field; only overwrite it if one was posted,
+        # otherwise the .env ends up with ICON_DIR=None.
+        if request.form.get('ICON_DIR'):
+            config['ICON_DIR'] = request.form.get('ICON_DIR')
         
         write_env(config)
         flash("Configuration updated!", "success")
         return redirect(url_for('admin'))
     
+    # Active apps on every TV plus the app list from TV01, from the poller's cache.
+    status = cached_status(tvs)
+    
     return render_template('admin.html',
                            config=config,
-                           tv1_ip=tv1_ip,
-                           tv2_ip=tv2_ip,
-                           active_app_tv1=active_app_tv1,
-                           active_app_tv2=active_app_tv2,
-                           apps=apps)
+                           tvs=tvs,
+                           groups=tv_config.tv_groups(config, tvs),
+                           devices=get_registry().devices(),
+                           event_retry=EVENT_RETRY,
+                           **status)
+
+@app.route('/api/status')
+@api_login_required
+def api_status():
+    """Cached state of every configured TV, straight from the poller, plus each TV's health."""
+    config = load_env()
+    tvs = configured_tvs(config)
+    groups = tv_config.tv_groups(config, tvs)
+    return jsonify({
+        "tvs": [asdict(tv) for tv in tvs],
+        "groups": {name: [tv.name for tv in members] for name, members in groups.items()},
+        "status": get_poller().cache.snapshot({tv.ip for tv in tvs}),
+        "health": get_health().snapshot({tv.ip for tv in tvs}),
+        "time": time.time(),
+    })
+
+@app.route('/api/events')
+@api_login_required
+def api_events():
+    """
+    Server-Sent Events stream of TV state: a "status" event per TV on connect, then
+    one whenever a TV's active app or reachability changes. Streams only listen to the
+    shared poller's cache, so any number of open tabs costs one poll per TV.
+    Past EVENT_STREAMS open streams, new ones are refused with a 503.
+    """
+    if not _event_streams.acquire(blocking=False):
+        return Response(f"retry: {EVENT_RETRY * 1000}\n\n", status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(EVENT_RETRY), 'Cache-Control': 'no-cache'})
+    changes = queue.Queue()
+    def on_change(tv_ip, kind, entry):
+        if kind == "active_app":
+            changes.put(tv_ip)
+    def stream():
+        cache = get_poller().cache
+        cache.add_listener(on_change)
+        deadline = time.monotonic() + EVENT_STREAM_LIFETIME
+        try:
+            for tv in configured_tvs(load_env()):
+                yield sse_event("status", tv_state(tv))
+            while time.monotonic() < deadline:
+                try:
+                    tv_ips = {changes.get(timeout=EVENT_KEEPALIVE)}
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                while not changes.empty():
+                    tv_ips.add(changes.get_nowait())
+                for tv in configured_tvs(load_env()):
+                    if tv.ip in tv_ips:
+                        yield sse_event("status", tv_state(tv))
+        finally:
+            cache.remove_listener(on_change)
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, even if the stream never started.
+    response.call_on_close(_event_streams.release)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """ECP latency, error, cache and queue metrics in Prometheus text format (no login, for scrapers)."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/devices')
+@api_login_required
+def api_devices():
+    """Every TV found by SSDP discovery, keyed by serial number."""
+    return jsonify({"devices": [asdict(device) for device in get_registry().devices()]})
+
+@app.route('/api/apps')
+@api_login_required
+def api_apps():
+    """
+    Search and page through one TV's installed apps, e.g.
+    GET /api/apps?tv=TV02&q=news&page=2&per_page=50 (tv defaults to the first TV).
+    """
+    tvs = configured_tvs(load_env())
+    tv_id = request.args.get('tv')
+    tv = find_tv(tvs, tv_id) if tv_id else (tvs[0] if tvs else None)
+    if tv is None:
+        return jsonify({"error": f"unknown TV: {tv_id}"}), 404
+    return jsonify(app_page(tv, request.args.get('q', ''),
+                            request.args.get('page', 1, type=int),
+                            request.args.get('per_page', DEFAULT_PER_PAGE, type=int)))
+
+@app.route('/api/apps/diff')
+@api_login_required
+def api_apps_diff():
+    """
+    Which apps are installed on which TVs, for a group or a comma-separated list
+    of TVs, e.g. GET /api/apps/diff?tv=TV01,TV03 (default: every TV).
+    """
+    config = load_env()
+    tvs = configured_tvs(config)
+    groups = tv_config.tv_groups(config, tvs)
+    selected = []
+    for tv_id in request.args.get('tv', 'all').split(','):
+        tv_id = tv_id.strip()
+        if tv_id.lower() in groups:
+            members = groups[tv_id.lower()]
+        else:
+            tv = find_tv(tvs, tv_id)
+            if tv is None:
+                return jsonify({"error": f"unknown TV or group: {tv_id}"}), 404
+            members = [tv]
+        selected.extend(tv for tv in members if tv not in selected)
+    return jsonify(get_catalog_index().diff(selected))
+
+@app.route('/api/tv/<tv_id>/keypress/<key>', methods=['POST'])
+@api_login_required
+def api_keypress(tv_id, key):
+    """Press a key on a TV or group, e.g. POST /api/tv/TV01/keypress/Home."""
+    tv_ips = resolve_target(tv_id)
+    if not tv_ips:
+        return jsonify({"error": f"unknown TV or group: {tv_id}"}), 404
+    return run_commands(tv_ips, [command_path({"keypress": key})])
+
+@app.route('/api/tv/<tv_id>/launch/<app_id>', methods=['POST'])
+@api_login_required
+def api_launch(tv_id, app_id):
+    """Launch an app on a TV or group, e.g. POST /api/tv/all/launch/12."""
+    tv_ips = resolve_target(tv_id)
+    if not tv_ips:
+        return jsonify({"error": f"unknown TV or group: {tv_id}"}), 404
+    return run_commands(tv_ips, [command_path({"launch": app_id})])
+
+@app.route('/api/tv/<tv_id>/batch', methods=['POST'])
+@api_login_required
+def api_batch(tv_id):
+    """
+    Send several commands in one call, in order, e.g.
+    {"commands": ["keypress/Home", {"launch": "12"}, "keypress/Select"]}.
+    """
+    tv_ips = resolve_target(tv_id)
+    if not tv_ips:
+        return jsonify({"error": f"unknown TV or group: {tv_id}"}), 404
+    body = request.get_json(silent=True) or {}
+    commands = body.get("commands") if isinstance(body, dict) else None
+    if not isinstance(commands, list) or not commands:
+        return jsonify({"error": "expected a JSON body with a non-empty \"commands\" list"}), 400
+    try:
+        paths = [command_path(command) for command in commands]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return run_commands(tv_ips, paths)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,112 @@
+"""
+Serving the admin app.
+
+ADMIN_SERVER selects how:
+  production  (default) waitress: a fixed pool of worker threads, HTTP/1.1
+              keep-alive and idle-connection timeouts. Falls back to
+              "builtin" if waitress is not installed.
+  builtin     Werkzeug's WSGI server with a bounded pool of worker threads
+              and socket timeouts. Werkzeug closes every connection after
+              one response, so there is no keep-alive.
+  development Flask's development server; ADMIN_DEBUG=1 turns on the debugger.
+
+ADMIN_THREADS bounds the worker pool and ADMIN_TIMEOUT (seconds) is how long
+a connection may sit idle or stall mid-request before it is closed. With
+either server every open dashboard's event stream holds one worker until it
+ends, so only ADMIN_EVENT_STREAMS of them (by default a quarter of
+ADMIN_THREADS) are served at once; see admin.api_events.
+"""
+import os
+import threading
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 9000
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Werkzeug's handler without per-request logging, speaking HTTP/1.1 so event streams can be chunked."""
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, code="-", size="-"):
+        pass  # one line per request is too much on a Pi's SD card
+
+
+class BoundedWSGIServer(BaseWSGIServer):
+    """
+    A Werkzeug server handling each connection on one of a fixed number of
+    worker threads. When all are busy, new connections wait in the listen
+    backlog instead of starting more threads.
+    """
+    daemon_threads = True
+
+    def __init__(self, host, port, app, threads=8, timeout=30):
+        handler = type("Handler", (QuietRequestHandler,), {"timeout": timeout})
+        super(BoundedWSGIServer, self).__init__(host, port, app, handler=handler)
+        self.threads = threads
+        self._slots = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()  # blocks the accept loop while every worker is busy
+        worker = threading.Thread(target=self._handle, args=(request, client_address),
+                                  name="admin-worker", daemon=True)
+        worker.start()
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+
+def worker_threads():
+    """Size of the worker pool, from ADMIN_THREADS."""
+    return max(1, _env_int("ADMIN_THREADS", 8))
+
+
+def make_server(app, host=DEFAULT_HOST, port=DEFAULT_PORT, threads=None, timeout=None):
+    """Create (but don't start) the builtin bounded server for app."""
+    if threads is None:
+        threads = worker_threads()
+    if timeout is None:
+        timeout = max(1, _env_int("ADMIN_TIMEOUT", 30))
+    return BoundedWSGIServer(host, port, app, threads=threads, timeout=timeout)
+
+
+def serve(app, host=None, port=None, mode=None):
+    """Serve app until the process exits, in the mode chosen by ADMIN_SERVER."""
+    host = host or os.environ.get("ADMIN_HOST", DEFAULT_HOST)
+    port = port or _env_int("ADMIN_PORT", DEFAULT_PORT)
+    mode = mode or os.environ.get("ADMIN_SERVER", "production")
+    if mode == "development":
+        debug = os.environ.get("ADMIN_DEBUG", "0") == "1"
+        app.run(debug=debug, use_reloader=False, threaded=True, host=host, port=port)
+        return
+    if mode == "production":
+        if waitress is not None:
+            threads = worker_threads()
+            print(f"Admin server on http://{host}:{port} (waitress, {threads} workers)")
+            waitress.serve(app, host=host, port=port, threads=threads,
+                           channel_timeout=max(1, _env_int("ADMIN_TIMEOUT", 30)),
+                           _quiet=True)
+            return
+        print("waitress not found. Using the builtin admin server (no keep-alive).")
+    server = make_server(app, host, port)
+    print(f"Admin server on http://{host}:{port} ({server.threads} workers)")
+    server.serve_forever()
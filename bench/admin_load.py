@@ -0,0 +1,152 @@
+"""
+Load test for the embedded admin server.
+
+Runs the admin app in a background thread of this process, like the kiosk
+does, and hits it with increasing numbers of keep-alive API clients. A
+main-thread loop ticking at 60 Hz stands in for Kivy's frame clock: a tick
+that runs more than a frame late counts as a dropped frame.
+
+    python bench/admin_load.py --mode production --clients 1,4,16,32
+
+Nothing talks to real TVs; SSDP discovery is off and the poller's cache is
+empty, so this measures the server itself.
+"""
+import argparse
+import http.client
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SSDP_DISCOVERY", "0")
+os.environ.setdefault("DEVICE_REGISTRY", os.path.join(tempfile.mkdtemp(), "devices.json"))
+
+FRAME = 1 / 60.0
+PASSWORD = "bench"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port):
+    import admin
+    from admin.server import serve
+    logging.getLogger("waitress.queue").setLevel(logging.ERROR)  # expected under load
+    from ecp.config import EnvFile
+    env_path = os.path.join(tempfile.mkdtemp(), ".env")
+    admin.env_file = EnvFile(env_path)
+    admin.env_file.write({"TV01_IP": "127.0.0.1", "TV02_IP": "127.0.0.2",
+                          "ADMIN_PASSWORD": PASSWORD})
+    threading.Thread(target=serve, args=(admin.app, "127.0.0.1", port, mode),
+                     daemon=True).start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("admin server did not start")
+
+
+def client(port, path, stop, latencies, errors):
+    conn = None
+    while not stop.is_set():
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            start = time.perf_counter()
+            conn.request("GET", path, headers={"X-Admin-Password": PASSWORD})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            latencies.append(time.perf_counter() - start)
+            if response.getheader("Connection", "").lower() == "close":
+                conn.close()
+                conn = None
+        except Exception as e:
+            errors.append(e)
+            if conn is not None:
+                conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def frame_probe(duration):
+    """Tick at 60 Hz on this thread; return (ticks, ticks more than a frame late)."""
+    ticks = late = 0
+    next_tick = time.perf_counter() + FRAME
+    end = time.perf_counter() + duration
+    while next_tick < end:
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+        if time.perf_counter() - next_tick > FRAME:
+            late += 1
+        ticks += 1
+        next_tick += FRAME
+    return ticks, late
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(port, path, clients, duration):
+    stop = threading.Event()
+    latencies, errors = [], []
+    workers = [threading.Thread(target=client, args=(port, path, stop, latencies, errors),
+                                daemon=True) for _ in range(clients)]
+    for worker in workers:
+        worker.start()
+    ticks, late = frame_probe(duration)
+    stop.set()
+    for worker in workers:
+        worker.join(5)
+    return {
+        "clients": clients,
+        "requests_per_s": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0.0,
+        "errors": len(errors),
+        "dropped_frames_pct": 100.0 * late / max(1, ticks),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", default="production",
+                        choices=("production", "builtin", "development"))
+    parser.add_argument("--clients", default="1,4,16,32",
+                        help="comma-separated concurrent client counts")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per step")
+    parser.add_argument("--path", default="/api/status")
+    args = parser.parse_args()
+
+    port = free_port()
+    start_server(args.mode, port)
+    print(f"{args.mode} server, GET {args.path}, {args.duration:g}s per step")
+    print(f"{'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'errors':>7} {'dropped frames':>15}")
+    for clients in [int(n) for n in args.clients.split(",")]:
+        result = run(port, args.path, clients, args.duration)
+        print(f"{result['clients']:>7} {result['requests_per_s']:>8.1f} {result['p50_ms']:>8.1f} "
+              f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>7} "
+              f"{result['dropped_frames_pct']:>14.1f}%")
+
+
+if __name__ == "__main__":
+    main()
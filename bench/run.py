@@ -0,0 +1,288 @@
+"""
+Benchmark suite against simulated TVs (see ecp/simulator.py).
+
+Measures:
+  command.keypress / command.launch   queue-to-answer round trip through the
+                                      dispatcher, as send_keypress/launch_app use it
+  command.burst                       BURST_SIZE taps queued at once, pipelined on one connection
+  command.broadcast                   one key press fanned out to a fleet of TVs
+  admin.page.healthy / .slow / .dead  GET /admin with TV01 healthy, slow or hung
+  admin.page.fleet                    GET /admin with a fleet of TVs configured
+  icon.cold / icon.warm               get_icon with an empty and a primed cache
+  kiosk.first_frame                   launch to first frame of main.py (needs a display)
+
+Results are written as JSON and can be compared against a stored baseline:
+
+    python bench/run.py --save-baseline             # writes bench/baseline.json
+    python bench/run.py --baseline bench/baseline.json
+
+Comparison fails (exit status 1) if any p50 is more than --tolerance slower.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SSDP_DISCOVERY", "0")
+os.environ.setdefault("DEVICE_REGISTRY", os.path.join(tempfile.mkdtemp(), "devices.json"))
+
+from ecp.simulator import Simulator  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+
+HEALTHY, SLOW, DEAD = "127.0.0.11", "127.0.0.12", "127.0.0.13"
+SLOW_DELAY = 0.2
+BURST_SIZE = 5  # tiles moved by a quick run of taps
+
+# The fleet: FLEET_SIZE TVs from FLEET_HOST answering in 10-30 ms, like real Rokus on wifi.
+FLEET_HOST = "127.0.2.1"
+FLEET_SIZE = 50
+FLEET_LATENCY, FLEET_JITTER = 0.02, 0.01
+
+
+def summarize(samples):
+    """Timing summary (milliseconds) of a list of durations in seconds."""
+    samples = sorted(samples)
+    def pct(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p50_ms": round(pct(50), 3),
+        "p95_ms": round(pct(95), 3),
+        "min_ms": round(samples[0] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def timed(fn, n, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+# -- benchmarks ---------------------------------------------------------
+def bench_command(path, n):
+    from ecp.dispatcher import CommandDispatcher
+    dispatcher = CommandDispatcher()
+    def send():
+        result = dispatcher.submit(HEALTHY, path).result(10)
+        if not result.ok:
+            raise RuntimeError(f"{path} failed: {result}")
+    try:
+        return timed(send, n)
+    finally:
+        dispatcher.stop()
+
+
+def bench_burst(n):
+    from ecp.dispatcher import CommandDispatcher
+    dispatcher = CommandDispatcher()
+    def send():
+        futures = [dispatcher.submit(HEALTHY, "keypress/Right") for _ in range(BURST_SIZE)]
+        failed = [result for result in (future.result(10) for future in futures) if not result.ok]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {BURST_SIZE} presses failed: {failed[0]}")
+    try:
+        return timed(send, n)
+    finally:
+        dispatcher.stop()
+
+
+def bench_broadcast(fleet, n):
+    from ecp.dispatcher import CommandDispatcher
+    dispatcher = CommandDispatcher()
+    def send():
+        results = dispatcher.broadcast(fleet.addresses, "keypress/Right").result(30)
+        failed = [result for result in results.values() if not result.ok]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(results)} TVs failed: {failed[0]}")
+    try:
+        return timed(send, n)
+    finally:
+        dispatcher.stop()
+
+
+def bench_admin_page(tv_ips, n):
+    import admin
+    from ecp.config import EnvFile
+    env_dir = tempfile.mkdtemp()
+    try:
+        config = {f"TV{i + 1:02d}_IP": tv_ip for i, tv_ip in enumerate(tv_ips)}
+        config.setdefault("TV02_IP", HEALTHY)
+        config["ADMIN_PASSWORD"] = "bench"
+        admin.env_file = EnvFile(os.path.join(env_dir, ".env"))
+        admin.env_file.write(config)
+        client = admin.app.test_client()
+        with client.session_transaction() as session:
+            session["logged_in"] = True
+        def get_page():
+            response = client.get("/admin")
+            if response.status_code != 200:
+                raise RuntimeError(f"/admin returned {response.status_code}")
+        return timed(get_page, n)
+    finally:
+        shutil.rmtree(env_dir, ignore_errors=True)
+
+
+def bench_icon(warm, n):
+    from ecp.icons import IconCache, IconLoader
+    icon_dir = tempfile.mkdtemp()
+    try:
+        if warm:
+            loader = IconLoader(icon_dir)
+            if not loader.get("12", HEALTHY):
+                raise RuntimeError("icon download failed")
+            return timed(lambda: loader.get("12", HEALTHY), n)
+        def cold():
+            # A fresh cache directory each time: download, scale and store.
+            path = os.path.join(icon_dir, str(time.perf_counter_ns()))
+            if not IconLoader(path, cache=IconCache(path)).get("12", HEALTHY):
+                raise RuntimeError("icon download failed")
+        return timed(cold, n, warmup=1)
+    finally:
+        shutil.rmtree(icon_dir, ignore_errors=True)
+
+
+def bench_first_frame(n):
+    """Run main.py until its first frame and read the time from its startup report."""
+    samples = []
+    for _ in range(n):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            admin_port = sock.getsockname()[1]
+        env = dict(os.environ, STARTUP_TIMING="1", STARTUP_EXIT="1", KIOSK_FULLSCREEN="0",
+                   TV01_IP=HEALTHY, TV02_IP=HEALTHY, ADMIN_PORT=str(admin_port),
+                   ENV_WATCH_INTERVAL="0", ICON_DIR=tempfile.mkdtemp())
+        try:
+            proc = subprocess.run([sys.executable, os.path.join(ROOT, "main.py")], env=env,
+                                  capture_output=True, text=True, timeout=60)
+        except subprocess.TimeoutExpired:
+            return {"skipped": "main.py did not exit within 60s"}
+        finally:
+            shutil.rmtree(env["ICON_DIR"], ignore_errors=True)
+        match = re.search(r"^\s*first frame\s+([\d.]+)", proc.stdout, re.MULTILINE)
+        if match is None:
+            lines = (proc.stderr or proc.stdout).strip().splitlines()
+            return {"skipped": f"no first frame (exit {proc.returncode}): "
+                               f"{lines[-1] if lines else 'no output'}"}
+        samples.append(float(match.group(1)))
+    return summarize(samples)
+
+
+BENCHMARKS = {
+    "command.keypress": lambda n, fleet: bench_command("keypress/Right", n),
+    "command.launch": lambda n, fleet: bench_command("launch/12", n),
+    "command.burst": lambda n, fleet: bench_burst(n),
+    "command.broadcast": lambda n, fleet: bench_broadcast(fleet, max(1, n // 5)),
+    "admin.page.healthy": lambda n, fleet: bench_admin_page([HEALTHY], n),
+    "admin.page.slow": lambda n, fleet: bench_admin_page([SLOW], n),
+    "admin.page.dead": lambda n, fleet: bench_admin_page([DEAD], n),
+    "admin.page.fleet": lambda n, fleet: bench_admin_page(fleet.addresses, n),
+    "icon.cold": lambda n, fleet: bench_icon(False, max(1, n // 10)),
+    "icon.warm": lambda n, fleet: bench_icon(True, n),
+    "kiosk.first_frame": lambda n, fleet: bench_first_frame(3),
+}
+
+
+# -- baseline comparison ------------------------------------------------
+def compare(results, baseline, tolerance):
+    """Print each benchmark against the baseline; return the names that regressed."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if "p50_ms" not in result or not base or "p50_ms" not in base:
+            continue
+        ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] else 1.0
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<22} p50 {base['p50_ms']:9.3f} -> {result['p50_ms']:9.3f} ms "
+              f"({(ratio - 1) * 100:+.0f}%){flag}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks against simulated TVs.")
+    parser.add_argument("--only", default="*", help="glob of benchmark names to run")
+    parser.add_argument("-n", type=int, default=100, help="samples per benchmark")
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help=f"also write the results to {DEFAULT_BASELINE}")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed p50 slowdown vs. the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    # The code under test logs with print(), also from poller and health tasks
+    # that outlive each benchmark. Point fd 1 at stderr for the whole run and
+    # keep a copy of the real stdout for the JSON report alone.
+    sys.stdout.flush()
+    report_out = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    # HEALTHY, SLOW and DEAD are consecutive addresses of one small simulator.
+    singles = Simulator(3, HEALTHY)
+    singles.tvs[1].latency = SLOW_DELAY
+    singles.tvs[2].hang_rate = 1.0
+    fleet = Simulator(FLEET_SIZE, FLEET_HOST, latency=FLEET_LATENCY, jitter=FLEET_JITTER)
+    singles.start_in_thread()
+    fleet.start_in_thread()
+    results = {}
+    try:
+        for name, bench in BENCHMARKS.items():
+            if not fnmatch.fnmatch(name, args.only):
+                continue
+            print(f"running {name} ...", file=sys.stderr)
+            try:
+                results[name] = bench(args.n, fleet)
+            except Exception as e:
+                results[name] = {"error": str(e)}
+    finally:
+        singles.stop_thread()
+        fleet.stop_thread()
+
+    report = {
+        "meta": {"time": time.time(), "python": platform.python_version(),
+                 "platform": platform.platform(), "machine": platform.machine()},
+        "results": results,
+    }
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        report_out.write(text + "\n")
+        report_out.flush()
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, "w") as f:
+            f.write(text + "\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+        print(f"compared with {args.baseline}:", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,8 +27,6 @@ except ImportError:
     Config.set('graphics', 'fullscreen', '0')
 
 import os
-import requests
-import xml.etree.ElementTree as ET
 import socket
 import sys
 import time
@@ -46,6 +44,8 @@ from kivy.uix.behaviors import ButtonBehavior
 
 from dotenv import load_dotenv, find_dotenv
 
+from ecp.client import EcpError, get_client, run_sync
+
 # Load the .env file.
 dotenv_path = find_dotenv()
 print("Found .env file at:", dotenv_path)
@@ -67,18 +67,17 @@ def get_icon(app_id, roku_ip):
         print(f"Loaded icon from file: {icon_path}")
         return icon_path
 
-    # Build the URL to fetch the icon from the Roku device.
-    url = f"http://{roku_ip}:8060/query/icon/{app_id}"
-    print(f"Fetching icon from: {url}")
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(icon_path, 'wb') as file:
-            file.write(response.content)
-        print(f"Saved icon to file: {icon_path}")
-        return icon_path
-    else:
-        print("Icon failed to save")
+    # Fetch the icon from the Roku device.
+    print(f"Fetching icon {app_id} from: {roku_ip}")
+    try:
+        icon = run_sync(get_client().icon(roku_ip, app_id))
+    except Exception as e:
+        print(f"Icon failed to save: {e}")
         return None
+    with open(icon_path, 'wb') as file:
+        file.write(icon.data)
+    print(f"Saved icon to file: {icon_path}")
+    return icon_path
 
 # ----------------------------------------------------------------------
 # Debounced Button Classes
@@ -375,15 +374,14 @@ class RemoteControlApp(App):
         For example, to send an "Up" command, POST to:
         http://<TV_IP>:8060/keypress/Up
         """
-        url = f"http://{self.active_tv}:8060/keypress/{key}"
         try:
-            response = requests.post(url)
-            if response.status_code == 200:
-                print(f"Sent '{key}' to {self.active_tv}")
+            run_sync(get_client().keypress(self.active_tv, key))
+            print(f"Sent '{key}' to {self.active_tv}")
+        except EcpError as e:
+            if e.status is not None:
+                print(f"Failed to send '{key}' command, status: {e.status}")
             else:
-                print(f"Failed to send '{key}' command, status: {response.status_code}")
-        except Exception as e:
-            print(f"Error sending '{key}': {e}")
+                print(f"Error sending '{key}': {e}")
 
     def launch_app(self, app_id):
         """
@@ -391,15 +389,14 @@ class RemoteControlApp(App):
         According to the API, you launch an app with:
         POST to /launch/<app_id>
         """
-        url = f"http://{self.active_tv}:8060/launch/{app_id}"
         try:
-            response = requests.post(url)
-            if response.status_code == 200:
-                print(f"Launched app '{app_id}' on {self.active_tv}")
+            run_sync(get_client().launch(self.active_tv, app_id))
+            print(f"Launched app '{app_id}' on {self.active_tv}")
+        except EcpError as e:
+            if e.status is not None:
+                print(f"Failed to launch app '{app_id}', status: {e.status}")
             else:
-                print(f"Failed to launch app '{app_id}', status: {response.status_code}")
-        except Exception as e:
-            print(f"Error launching app '{app_id}': {e}")
+                print(f"Error launching app '{app_id}': {e}")
 
 if __name__ == '__main__':
     # Start the Flask app from admin.py in a separate thread.
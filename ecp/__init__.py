@@ -0,0 +1,49 @@
+"""
+Shared helpers for talking to Roku TVs over the External Control Protocol (ECP).
+
+Used by both the kiosk (main.py) and the admin web server (admin/).
+"""
+import os
+import stat
+import tempfile
+
+ECP_PORT = 8060
+
+
+def split_address(address, default_port=ECP_PORT):
+    """
+    Split a TV address into (host, port). TVs are normally configured by IP
+    alone; "host:port" is accepted too, e.g. for simulated TVs (ecp.simulator).
+    """
+    host, sep, port = str(address).rpartition(":")
+    if sep and host and port.isdigit():
+        return host, int(port)
+    return str(address), default_port
+
+
+def write_atomic(path, data):
+    """
+    Write data to path via a temp file in the same directory and a rename.
+    An existing file keeps its permissions, and if path is a symlink the file
+    it points to is replaced rather than the link.
+    """
+    path = os.path.realpath(path)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = None  # new files get mkstemp's 0600
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
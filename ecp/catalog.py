@@ -0,0 +1,165 @@
+"""
+Searchable, paginated index of each TV's installed apps.
+
+The poller fetches every TV's app list in the background (see
+ecp/poller.py). CatalogIndex turns each list into an AppCatalog -- sorted
+by name once, when the list changes, rather than on every page view -- so
+the admin can search and page through hundreds of channels, and compare
+which apps are installed on which TVs, without touching the network.
+"""
+import bisect
+import threading
+
+from ecp.poller import get_poller
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+
+def _sort_key(app):
+    return (app.name.lower(), app.id)
+
+
+class AppCatalog(object):
+    """
+    One TV's apps, sorted case-insensitively by name. Read-only once built,
+    so it can be shared between threads.
+    """
+    def __init__(self, apps=(), fetched_at=None):
+        self.apps = sorted(apps, key=_sort_key)
+        self.fetched_at = fetched_at
+        self._keys = [_sort_key(app) for app in self.apps]
+        self._by_id = {app.id: app for app in self.apps}
+
+    def __len__(self):
+        return len(self.apps)
+
+    def __contains__(self, app_id):
+        return app_id in self._by_id
+
+    def get(self, app_id):
+        return self._by_id.get(app_id)
+
+    def ids(self):
+        return set(self._by_id)
+
+    def search(self, query=""):
+        """
+        Apps whose name contains query (case-insensitive) or whose ID is query,
+        in name order. Apps whose name starts with query come first; they are
+        found by bisecting the sorted names rather than scanning them.
+        """
+        query = query.strip().lower()
+        if not query:
+            return self.apps
+        start = bisect.bisect_left(self._keys, (query,))
+        end = bisect.bisect_left(self._keys, (query + "\uffff",))
+        prefix = self.apps[start:end]
+        rest = [app for app in self.apps[:start] + self.apps[end:]
+                if query in app.name.lower() or app.id == query]
+        return prefix + rest
+
+    def page(self, query="", page=1, per_page=DEFAULT_PER_PAGE):
+        """One page of search(query) as a JSON-ready dict; page numbers start at 1."""
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        matches = self.search(query)
+        pages = max(1, -(-len(matches) // per_page))
+        page = max(1, min(page, pages))
+        start = (page - 1) * per_page
+        return {
+            "query": query,
+            "page": page,
+            "per_page": per_page,
+            "pages": pages,
+            "total": len(matches),
+            "apps": [{"id": app.id, "name": app.name}
+                     for app in matches[start:start + per_page]],
+        }
+
+
+class CatalogIndex(object):
+    """
+    AppCatalogs for every polled TV, built from the poller's cache on first
+    use and dropped whenever the poller sees a TV's app list change.
+    """
+    def __init__(self, cache=None):
+        self.cache = cache or get_poller().cache
+        self._catalogs = {}  # tv_ip -> AppCatalog
+        self._lock = threading.Lock()
+        self.cache.add_listener(self._on_change)
+
+    def _on_change(self, tv_ip, kind, entry):
+        if kind == "apps":
+            with self._lock:
+                self._catalogs.pop(tv_ip, None)
+
+    def catalog(self, tv_ip):
+        """The AppCatalog for tv_ip, or None if its apps have never been fetched."""
+        with self._lock:
+            catalog = self._catalogs.get(tv_ip)
+        if catalog is not None:
+            return catalog
+        entry = self.cache.get(tv_ip, "apps")
+        if entry is None or entry.value is None:
+            return None
+        # Errors keep the last good list (see StateCache.set), so this may be stale.
+        catalog = AppCatalog(entry.value, entry.fetched_at)
+        with self._lock:
+            self._catalogs[tv_ip] = catalog
+        return catalog
+
+    def status(self, tv_ip):
+        """(AppCatalog or None, error text or None) for tv_ip."""
+        entry = self.cache.get(tv_ip, "apps")
+        error = None
+        if entry is None:
+            error = "not fetched yet"
+        elif entry.error is not None:
+            error = str(entry.error)
+        return self.catalog(tv_ip), error
+
+    def diff(self, tvs):
+        """
+        Which apps are installed where, across tvs (ecp.config.TV objects).
+        Apps installed on every TV are only counted; every other app is listed
+        with the TVs it is on and the TVs it is missing from. TVs whose app
+        list has never been fetched are reported as unknown and left out.
+        """
+        catalogs = {}
+        unknown = []
+        for tv in tvs:
+            catalog = self.catalog(tv.ip)
+            if catalog is None:
+                unknown.append(tv.name)
+            else:
+                catalogs[tv.name] = catalog
+        all_ids = set().union(*(catalog.ids() for catalog in catalogs.values()))
+        apps = []
+        common = 0
+        for app_id in all_ids:
+            installed = [name for name, catalog in catalogs.items() if app_id in catalog]
+            if len(installed) == len(catalogs):
+                common += 1
+                continue
+            app = catalogs[installed[0]].get(app_id)
+            apps.append({
+                "id": app_id,
+                "name": app.name,
+                "installed": installed,
+                "missing": [name for name in catalogs if name not in installed],
+            })
+        apps.sort(key=lambda row: (row["name"].lower(), row["id"]))
+        return {"tvs": list(catalogs), "unknown": unknown, "common": common, "apps": apps}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_catalog_index():
+    """Return the process-wide CatalogIndex over the shared poller's cache."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CatalogIndex()
+        return _index
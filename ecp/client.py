@@ -0,0 +1,628 @@
+"""
+Asyncio client for the Roku External Control Protocol.
+
+Speaks plain HTTP/1.1 over asyncio streams, so it needs nothing beyond the
+standard library. Connections to each TV are kept alive between calls, and
+the number of requests in flight is capped both overall and per TV, so many
+TVs can be queried concurrently from a single event loop. Queries (GETs)
+can never take the last COMMAND_RESERVE overall slots, so key presses don't
+queue behind polls of TVs that have stopped answering.
+
+Blocking code (Kivy callbacks, Flask views) should use run_sync(), which runs
+a coroutine on a shared background event loop:
+
+    info = run_sync(get_client().device_info("10.24.10.23"))
+"""
+import asyncio
+import contextlib
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from urllib.parse import quote, urlencode
+
+from ecp import ECP_PORT, metrics, split_address
+from ecp.health import get_health
+
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+CONNECT_TIMEOUT = _env_float("ECP_CONNECT_TIMEOUT", 2)  # seconds to open a connection
+READ_TIMEOUT = _env_float("ECP_READ_TIMEOUT", 3)        # seconds to wait for an answer
+MAX_CONCURRENCY = 16     # requests in flight across all TVs
+MAX_PER_HOST = 2         # Rokus only cope with a couple of parallel connections
+COMMAND_RESERVE = 4      # overall slots only commands (POSTs) may use
+READ_CHUNK = 16384       # bytes handed to a streaming consumer at a time
+
+
+class EcpError(Exception):
+    """An ECP request failed; status is the HTTP status if the TV answered."""
+    def __init__(self, message, status=None):
+        super(EcpError, self).__init__(message)
+        self.status = status
+
+
+class ClientBusy(EcpError):
+    """
+    No connection slot came free in time. Says nothing about the TV itself,
+    so it is not reported to health tracking.
+    """
+
+
+class ConnectionClosed(ConnectionError):
+    """The TV closed the connection before sending any part of a response."""
+
+
+@dataclass
+class Response:
+    status: int
+    reason: str
+    headers: Dict[str, str]
+    body: bytes
+    elapsed: float = 0.0  # seconds
+
+    @property
+    def ok(self):
+        return self.status == 200
+
+
+@dataclass
+class App:
+    id: str
+    name: str
+    type: str = ""
+    version: str = ""
+
+
+@dataclass
+class ActiveApp:
+    app: Optional[App]
+    screensaver: Optional[App] = None
+
+    @property
+    def name(self):
+        return self.app.name if self.app is not None else None
+
+
+@dataclass
+class DeviceInfo:
+    serial_number: str
+    model_name: str
+    friendly_name: str
+    software_version: str
+    power_mode: str
+    network_type: str
+    fields: Dict[str, str] = field(default_factory=dict)  # every <device-info> child
+
+
+@dataclass
+class Icon:
+    app_id: str
+    content_type: str
+    data: bytes
+
+
+# ----------------------------------------------------------------------
+# HTTP/1.1 framing
+# ----------------------------------------------------------------------
+def format_request(method, host, port, path, body=b""):
+    """Serialise a minimal keep-alive HTTP/1.1 request."""
+    head = (f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            f"User-Agent: br-controller\r\n"
+            f"Connection: keep-alive\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n")
+    return head.encode("ascii") + body
+
+
+async def read_response(reader, method="GET", on_body=None):
+    """
+    Read one HTTP response from reader.
+    Returns (Response, keep_alive).
+
+    If on_body is given it is called with each piece of the body as it
+    arrives, and the returned Response has an empty body.
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            raise ConnectionClosed("connection closed before response")
+        raise
+    lines = head.decode("iso-8859-1").split("\r\n")
+    version, _, rest = lines[0].partition(" ")
+    status_text, _, reason = rest.partition(" ")
+    status = int(status_text)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+
+    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+        body = b""
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        body = await _read_chunked(reader, on_body)
+    elif "content-length" in headers:
+        body = await _read_length(reader, int(headers["content-length"]), on_body)
+    else:
+        body = await _read_to_eof(reader, on_body)
+        keep_alive = False
+    return Response(status, reason, headers, body), keep_alive
+
+
+async def _read_length(reader, length, on_body):
+    if on_body is None:
+        return await reader.readexactly(length)
+    while length:
+        piece = await reader.readexactly(min(length, READ_CHUNK))
+        on_body(piece)
+        length -= len(piece)
+    return b""
+
+
+async def _read_to_eof(reader, on_body):
+    if on_body is None:
+        return await reader.read()
+    while True:
+        piece = await reader.read(READ_CHUNK)
+        if not piece:
+            return b""
+        on_body(piece)
+
+
+async def _read_chunked(reader, on_body=None):
+    chunks = []
+    while True:
+        size_line = await reader.readuntil(b"\r\n")
+        size = int(size_line.split(b";", 1)[0].strip(), 16)
+        if size == 0:
+            # Skip any trailers up to the terminating blank line.
+            while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                pass
+            return b"".join(chunks)
+        if on_body is None:
+            chunks.append(await reader.readexactly(size))
+        else:
+            await _read_length(reader, size, on_body)
+        await reader.readexactly(2)
+
+
+class _Connection(object):
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+
+    @property
+    def usable(self):
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+# ----------------------------------------------------------------------
+# Client
+# ----------------------------------------------------------------------
+class EcpClient(object):
+    """
+    Keep-alive ECP client for any number of TVs.
+
+    All coroutines take the TV's host as their first argument. Instances
+    must only be used from one event loop.
+
+    connect_timeout (default ECP_CONNECT_TIMEOUT) bounds opening a connection
+    to a TV, and timeout (default ECP_READ_TIMEOUT) both the wait for a free
+    connection slot and the wait for the TV's answer, in seconds.
+    """
+    def __init__(self, port=ECP_PORT, timeout=None, connect_timeout=None,
+                 max_concurrency=MAX_CONCURRENCY, max_per_host=MAX_PER_HOST,
+                 command_reserve=COMMAND_RESERVE):
+        self.port = port
+        self.timeout = READ_TIMEOUT if timeout is None else timeout
+        self.connect_timeout = CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.command_reserve = min(command_reserve, max_concurrency - 1)
+        self._idle = {}          # host -> [_Connection]
+        self._host_limits = {}   # host -> asyncio.Semaphore
+        self._limit = None       # created on first use, inside the running loop
+        self._query_limit = None
+        self._no_pipelining = set()  # hosts that closed the connection mid-pipeline
+
+    # -- raw requests ---------------------------------------------------
+    async def request(self, host, method, path, body=b"", timeout=None, on_body=None):
+        """
+        Send one request and return the Response, whatever its status.
+        With on_body the response body is streamed to it (see read_response).
+        """
+        timeout = timeout or self.timeout
+        start = time.monotonic()
+        try:
+            async with self._slots(host, method, timeout):
+                sent = time.monotonic()  # the TV is only timed from here on
+                response = await self._send(host, method, path, body, timeout, on_body)
+        except ClientBusy:
+            metrics.record_request(host, path, time.monotonic() - start, "busy")
+            raise
+        except asyncio.TimeoutError:
+            metrics.record_request(host, path, time.monotonic() - start, "timeout")
+            get_health().record(host, False, error="timed out")
+            raise EcpError(f"{method} {path} to {host} timed out")
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            metrics.record_request(host, path, time.monotonic() - start, type(e).__name__)
+            get_health().record(host, False, error=e)
+            raise EcpError(f"{method} {path} to {host} failed: {e}")
+        response.elapsed = time.monotonic() - start
+        metrics.record_request(host, path, response.elapsed,
+                               None if response.ok else f"http_{response.status}")
+        get_health().record(host, True, time.monotonic() - sent)
+        return response
+
+    async def pipeline(self, host, method, paths, timeout=None, pace=0.0, window=None):
+        """
+        Send several bodiless requests to one TV back-to-back on one keep-alive
+        connection, without waiting for each answer before sending the next
+        (HTTP/1.1 pipelining), and read the answers in order. A burst of n key
+        presses costs about one round trip instead of n.
+
+        pace spaces the requests at least that many seconds apart, and window
+        caps how many may be unanswered at once, for TVs that drop input sent
+        faster than they can handle it (e.g. typed characters).
+
+        Returns a list holding a Response or an EcpError for each path. Requests
+        left unanswered when the TV closes the connection are not resent (a
+        resent keypress could be pressed twice), and that TV is sent one request
+        at a time from then on.
+        """
+        if host in self._no_pipelining or len(paths) == 1:
+            results = []
+            for i, path in enumerate(paths):
+                if i and pace:
+                    await asyncio.sleep(pace)
+                try:
+                    results.append(await self.request(host, method, path, timeout=timeout))
+                except EcpError as e:
+                    results.append(e)
+            return results
+        timeout = timeout or self.timeout
+        start = time.monotonic()
+        results = []
+        try:
+            async with self._slots(host, method, timeout):
+                start = time.monotonic()  # time the TV, not the wait for a slot
+                conn = self._take_idle(host)
+                while True:
+                    try:
+                        if conn is None:
+                            conn = await asyncio.wait_for(self.connect(host),
+                                                          self.connect_timeout)
+                        await self._exchange_pipelined(host, conn, method, paths, timeout,
+                                                       start, results, pace, window)
+                        break
+                    except (ConnectionClosed, ConnectionResetError, BrokenPipeError):
+                        if conn is not None and conn.reused and not results:
+                            conn = None
+                            continue  # the TV dropped the idle socket before we used it
+                        error = "connection closed"
+                        if results:
+                            self._no_pipelining.add(host)  # answered some, then hung up
+                    except asyncio.TimeoutError:
+                        error = "timed out"
+                    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                        error = e
+                    elapsed = time.monotonic() - start
+                    for path in paths[len(results):]:
+                        metrics.record_request(host, path, elapsed, "pipeline_unanswered")
+                    get_health().record(host, False, error=error)
+                    results.extend(EcpError(f"{method} {path} to {host} got no answer: {error}")
+                                   for path in paths[len(results):])
+                    break
+        except ClientBusy as e:
+            for path in paths:
+                metrics.record_request(host, path, time.monotonic() - start, "busy")
+            return [e] * len(paths)
+        return results
+
+    async def _exchange_pipelined(self, host, conn, method, paths, timeout, start, results,
+                                  pace=0.0, window=None):
+        """Write the requests while appending each Response to results as it is read."""
+        address, port = split_address(host, self.port)
+        slots = asyncio.Semaphore(window or len(paths))
+        async def send():
+            for i, path in enumerate(paths):
+                await slots.acquire()
+                if i and pace:
+                    await asyncio.sleep(pace)
+                conn.writer.write(format_request(method, address, port, path))
+                await conn.writer.drain()
+        if pace or window:
+            sender = asyncio.ensure_future(send())
+        else:
+            sender = None
+            conn.writer.write(b"".join(format_request(method, address, port, path)
+                                       for path in paths))
+        keep_alive = True
+        try:
+            if sender is None:
+                await conn.writer.drain()
+            for path in paths:
+                if not keep_alive:
+                    raise ConnectionClosed("connection closed mid-pipeline")
+                response, keep_alive = await asyncio.wait_for(
+                    read_response(conn.reader, method), timeout)
+                response.elapsed = time.monotonic() - start
+                metrics.record_request(host, path, response.elapsed,
+                                       None if response.ok else f"http_{response.status}")
+                get_health().record(host, True, response.elapsed)
+                results.append(response)
+                slots.release()
+        except BaseException:
+            conn.close()
+            raise
+        finally:
+            if sender is not None:
+                sender.cancel()
+                # A failed write shows up as a failed read; don't also log it as unretrieved.
+                await asyncio.gather(sender, return_exceptions=True)
+        if keep_alive:
+            conn.reused = True
+            self._idle.setdefault(host, []).append(conn)
+        else:
+            conn.close()
+
+    def _semaphores(self, host, method):
+        """The concurrency limits a request to host takes, in the order to take them."""
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_concurrency)
+            self._query_limit = asyncio.Semaphore(self.max_concurrency - self.command_reserve)
+        host_limit = self._host_limits.get(host)
+        if host_limit is None:
+            host_limit = self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        # The per-TV slot comes first so a backed-up TV can't hold overall slots.
+        if method == "GET":
+            return host_limit, self._query_limit, self._limit
+        return host_limit, self._limit
+
+    @contextlib.asynccontextmanager
+    async def _slots(self, host, method, timeout):
+        """Hold every slot a request to host needs, waiting at most timeout for them."""
+        held = []
+        async def take():
+            for limit in self._semaphores(host, method):
+                await limit.acquire()
+                held.append(limit)
+        try:
+            await asyncio.wait_for(take(), timeout)
+        except asyncio.TimeoutError:
+            for limit in reversed(held):
+                limit.release()
+            raise ClientBusy(f"{method} to {host} found no free connection within {timeout}s")
+        try:
+            yield
+        finally:
+            for limit in reversed(held):
+                limit.release()
+
+    async def _send(self, host, method, path, body, timeout, on_body=None):
+        conn = self._take_idle(host)
+        if conn is not None:
+            try:
+                return await asyncio.wait_for(
+                    self._exchange(host, conn, method, path, body, on_body), timeout)
+            except (ConnectionClosed, ConnectionResetError, BrokenPipeError):
+                pass  # the TV dropped the idle socket before we used it; retry fresh
+        conn = await asyncio.wait_for(self.connect(host), self.connect_timeout)
+        return await asyncio.wait_for(
+            self._exchange(host, conn, method, path, body, on_body), timeout)
+
+    async def connect(self, host):
+        reader, writer = await asyncio.open_connection(*split_address(host, self.port))
+        return _Connection(reader, writer)
+
+    async def _exchange(self, host, conn, method, path, body, on_body=None):
+        try:
+            address, port = split_address(host, self.port)
+            conn.writer.write(format_request(method, address, port, path, body))
+            await conn.writer.drain()
+            response, keep_alive = await read_response(conn.reader, method, on_body)
+        except BaseException:
+            conn.close()
+            raise
+        if keep_alive:
+            conn.reused = True
+            self._idle.setdefault(host, []).append(conn)
+        else:
+            conn.close()
+        return response
+
+    def _take_idle(self, host):
+        idle = self._idle.get(host)
+        while idle:
+            conn = idle.pop()
+            if conn.usable:
+                return conn
+            conn.close()
+        return None
+
+    async def close(self):
+        """Close every idle connection."""
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    async def _command(self, host, path):
+        response = await self.request(host, "POST", path)
+        if not response.ok:
+            raise EcpError(f"POST {path} to {host} returned {response.status}",
+                           status=response.status)
+        return response
+
+    async def _query(self, host, path, on_body=None):
+        response = await self.request(host, "GET", path, on_body=on_body)
+        if not response.ok:
+            raise EcpError(f"GET {path} from {host} returned {response.status}",
+                           status=response.status)
+        return response
+
+    # -- commands -------------------------------------------------------
+    async def keypress(self, host, key):
+        return await self._command(host, f"/keypress/{quote(key, safe='')}")
+
+    async def keydown(self, host, key):
+        return await self._command(host, f"/keydown/{quote(key, safe='')}")
+
+    async def keyup(self, host, key):
+        return await self._command(host, f"/keyup/{quote(key, safe='')}")
+
+    async def launch(self, host, app_id, **params):
+        path = f"/launch/{quote(str(app_id), safe='')}"
+        if params:
+            path += "?" + urlencode(params)
+        return await self._command(host, path)
+
+    # -- queries --------------------------------------------------------
+    async def apps(self, host):
+        """
+        Installed apps, in the order the TV lists them. The XML is parsed as it
+        arrives, so a TV with hundreds of channels never has its whole reply
+        (or a tree of it) in memory at once.
+        """
+        parser = AppListParser()
+        await self._query(host, "/query/apps", on_body=parser.feed)
+        return parser.close(host)
+
+    async def active_app(self, host):
+        response = await self._query(host, "/query/active-app")
+        root = _parse_xml(response.body, host)
+        app_elem = root.find("app")
+        screensaver_elem = root.find("screensaver")
+        return ActiveApp(
+            app=_parse_app(app_elem) if app_elem is not None else None,
+            screensaver=_parse_app(screensaver_elem) if screensaver_elem is not None else None,
+        )
+
+    async def device_info(self, host):
+        response = await self._query(host, "/query/device-info")
+        root = _parse_xml(response.body, host)
+        fields = {child.tag: (child.text or "").strip() for child in root}
+        return DeviceInfo(
+            serial_number=fields.get("serial-number", ""),
+            model_name=fields.get("model-name", ""),
+            friendly_name=fields.get("friendly-device-name") or fields.get("user-device-name", ""),
+            software_version=fields.get("software-version", ""),
+            power_mode=fields.get("power-mode", ""),
+            network_type=fields.get("network-type", ""),
+            fields=fields,
+        )
+
+    async def icon(self, host, app_id):
+        response = await self._query(host, f"/query/icon/{quote(str(app_id), safe='')}")
+        return Icon(str(app_id), response.headers.get("content-type", ""), response.body)
+
+
+def _parse_xml(body, host):
+    try:
+        return ET.fromstring(body)
+    except ET.ParseError as e:
+        raise EcpError(f"Bad XML from {host}: {e}")
+
+
+class AppListParser(object):
+    """
+    Incremental parser for a /query/apps reply: feed() it the body piece by
+    piece, then close() returns the Apps. Each <app> element is dropped once
+    parsed, so memory stays flat however long the list is.
+    """
+    def __init__(self):
+        self.apps = []
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root = None
+        self._error = None
+
+    def feed(self, data):
+        if self._error is not None:
+            return
+        try:
+            self._parser.feed(data)
+            self._collect()
+        except ET.ParseError as e:
+            # Kept until close(), so a bad body doesn't break the connection mid-read.
+            self._error = e
+
+    def close(self, host=""):
+        if self._error is None:
+            try:
+                self._parser.close()
+                self._collect()
+            except ET.ParseError as e:
+                self._error = e
+        if self._error is not None:
+            raise EcpError(f"Bad XML from {host}: {self._error}")
+        return self.apps
+
+    def _collect(self):
+        for event, elem in self._parser.read_events():
+            if self._root is None:
+                self._root = elem
+            elif event == "end" and elem.tag == "app":
+                self.apps.append(_parse_app(elem))
+                if len(self._root) and self._root[-1] is elem:
+                    self._root.remove(elem)
+
+
+def _parse_app(elem):
+    return App(
+        id=elem.attrib.get("id", ""),
+        name=(elem.text or "").strip(),
+        type=elem.attrib.get("type", ""),
+        version=elem.attrib.get("version", ""),
+    )
+
+
+# ----------------------------------------------------------------------
+# Shared background loop for blocking callers
+# ----------------------------------------------------------------------
+_loop = None
+_client = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    """Return the shared ECP event loop, starting its thread on first use."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="ecp-loop")
+            thread.daemon = True
+            thread.start()
+        return _loop
+
+
+def get_client():
+    """Return the process-wide EcpClient that runs on get_loop()."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = EcpClient()
+        return _client
+
+
+def run_sync(coro, timeout=None):
+    """
+    Run a coroutine on the shared loop and block until it finishes.
+    Must not be called from the loop's own thread.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
@@ -0,0 +1,150 @@
+"""
+The .env configuration file, which TVs it configures, and how they are grouped.
+
+EnvFile caches the parsed file and only re-reads it when it changes on disk,
+and writes it atomically. TVs come from TV01_IP, TV02_IP, ... TVnn_IP in the
+.env file (with optional TVnn_NAME and TVnn_SERIAL). Groups are
+GROUP_<NAME>=TV01,TV03,... entries; an "all" group containing every TV
+always exists.
+"""
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from ecp import write_atomic
+from ecp.discovery import get_registry
+
+# TV01 and TV02 have always existed; keep their defaults when unset.
+DEFAULT_TVS = {"TV01": "10.24.10.23", "TV02": "10.24.10.99"}
+
+_TV_KEY = re.compile(r"^TV(\d+)_IP$")
+_GROUP_KEY = re.compile(r"^GROUP_(\w+)$")
+_TV_SETTING = re.compile(r"^(TV\d+_(IP|NAME|SERIAL)|GROUP_\w+)$")
+
+
+def is_tv_setting(key):
+    """True for .env keys that configured_tvs() or tv_groups() read."""
+    return bool(_TV_SETTING.match(key))
+
+
+def parse_env(text):
+    """Parse KEY=value lines; blank lines and # comments are skipped."""
+    config = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            if '=' in line:
+                key, value = line.split('=', 1)
+                config[key.strip()] = value.strip()
+    return config
+
+
+def diff_env(old, new):
+    """Keys that were added, removed or changed between two parsed configs."""
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+
+class EnvFile(object):
+    """
+    A .env file parsed once and cached until it changes on disk.
+
+    The file's mtime, size and inode are checked on every load(); that is a
+    single stat(), so callers can load() as often as they like. write()
+    replaces the file atomically, so readers never see it half-written.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._config = {}
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def changed(self):
+        """True if the file differs from what was last loaded."""
+        return self._stat() != self._stamp
+
+    def load(self):
+        """Return a copy of the parsed file, re-reading it only if it changed."""
+        with self._lock:
+            stamp = self._stat()
+            if stamp != self._stamp:
+                try:
+                    with open(self.path) as f:
+                        self._config = parse_env(f.read())
+                except OSError:
+                    self._config = {}
+                self._stamp = stamp
+            return dict(self._config)
+
+    def write(self, config):
+        """Atomically replace the file with the key-value pairs in config."""
+        data = "".join(f"{key}={value}\n" for key, value in config.items())
+        with self._lock:
+            write_atomic(self.path, data.encode("utf-8"))
+            self._config = dict(config)
+            self._stamp = self._stat()
+
+
+@dataclass
+class TV:
+    name: str                 # config prefix, e.g. "TV01"
+    number: int               # 1 for TV01
+    configured_ip: str        # TVnn_IP as written in the config
+    ip: str                   # current address, after following the device registry
+    serial: Optional[str] = None
+    label: str = ""           # TVnn_NAME, or "TV <number>"
+
+
+def configured_tvs(config, registry=None):
+    """
+    Return every configured TV, ordered by number. config is any mapping of
+    .env keys (the admin's parsed .env, or os.environ in the kiosk).
+    """
+    registry = registry or get_registry()
+    numbers = {int(match.group(1)) for match in map(_TV_KEY.match, config) if match}
+    numbers.update(int(name[2:]) for name in DEFAULT_TVS)
+    tvs = []
+    for number in sorted(numbers):
+        name = f"TV{number:02d}"
+        ip = (config.get(f"{name}_IP") or DEFAULT_TVS.get(name, "")).strip()
+        if not ip:
+            continue
+        serial = (config.get(f"{name}_SERIAL") or "").strip() or None
+        registry.remember(ip, serial)
+        tvs.append(TV(name=name, number=number, configured_ip=ip,
+                      ip=registry.resolve(ip, serial), serial=serial,
+                      label=config.get(f"{name}_NAME") or f"TV {number}"))
+    return tvs
+
+
+def tv_groups(config, tvs):
+    """
+    Return {group name: [TV, ...]} from GROUP_<NAME>=TV01,TV02 entries, plus
+    "all". Members may be given as TV01, 1 or an IP; unknown ones are skipped.
+    """
+    by_key = {}
+    for tv in tvs:
+        for key in (tv.name, str(tv.number), tv.configured_ip, tv.ip):
+            by_key[key.upper()] = tv
+    groups = {}
+    for key in sorted(config):
+        match = _GROUP_KEY.match(key)
+        if not match:
+            continue
+        members = []
+        for member in config[key].split(","):
+            tv = by_key.get(member.strip().upper())
+            if tv is not None and tv not in members:
+                members.append(tv)
+        if members:
+            groups[match.group(1).lower()] = members
+    groups["all"] = list(tvs)
+    return groups
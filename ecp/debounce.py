@@ -0,0 +1,53 @@
+"""
+Debouncing of touchscreen taps before they become ECP commands.
+
+Cheap touchscreens often report one tap as two releases a few tens of
+milliseconds apart. Sending both would move the TV's cursor twice, but a
+flat debounce long enough to catch slow bounces also eats the fast taps of
+someone moving across a row of tiles. AdaptiveDebouncer drops only what is
+clearly a double-fire and otherwise follows the user's own tapping speed.
+"""
+import time
+from collections import deque
+
+
+class AdaptiveDebouncer(object):
+    """
+    Per-key debounce that adapts to how fast the user is tapping.
+
+    A release within min_interval of the previous tap on the same key is a
+    touchscreen double-fire: it is dropped and not counted as a tap. Every
+    other release is a tap, and its gap counts toward the key's window, which
+    is half the fastest recent gap (between min_interval and max_interval).
+    A tap is dropped only if it comes within the window of the previous one,
+    so a slow tapper is protected from slow bounces while fast taps, whose
+    short gaps shrink the window at once, all get through.
+    """
+    def __init__(self, min_interval=0.08, max_interval=0.3, history=4):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.history = history
+        self._last = {}   # key -> time of the last tap (double-fires excluded)
+        self._gaps = {}   # key -> recent gaps between taps
+
+    def window(self, key):
+        """Seconds after a tap on key during which another one is ignored."""
+        gaps = self._gaps.get(key)
+        if not gaps:
+            return self.min_interval
+        return min(self.max_interval, max(self.min_interval, min(gaps) / 2))
+
+    def accept(self, key, now=None):
+        """True if this release of key should act, False if it is a bounce."""
+        now = time.monotonic() if now is None else now
+        last = self._last.get(key)
+        if last is None:
+            self._last[key] = now
+            return True
+        gap = now - last
+        if gap < self.min_interval:
+            return False  # a double-fire; the next gap is still measured from the tap
+        accepted = gap >= self.window(key)
+        self._last[key] = now
+        self._gaps.setdefault(key, deque(maxlen=self.history)).append(gap)
+        return accepted
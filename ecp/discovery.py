@@ -0,0 +1,275 @@
+"""
+SSDP discovery of Roku TVs and a persistent registry of where they are.
+
+discover() multicasts an M-SEARCH for "roku:ecp" and collects replies for a
+bounded time. DeviceRegistry remembers every TV it has seen, keyed by serial
+number, in a JSON file, and keeps re-discovering in the background. A TV
+configured by IP keeps working after DHCP moves it: the registry remembers
+which serial was last seen at that IP and resolves it to the new address.
+"""
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from dataclasses import asdict, dataclass
+from urllib.parse import urlparse
+
+from ecp import ECP_PORT, write_atomic
+from ecp.client import get_loop
+
+SSDP_ADDRESS = ("239.255.255.250", 1900)
+SEARCH_TARGET = "roku:ecp"
+DISCOVERY_TIMEOUT = 3      # seconds to listen for replies
+DISCOVERY_INTERVAL = 300   # seconds between background searches
+
+
+@dataclass
+class DiscoveredDevice:
+    serial: str
+    host: str
+    port: int
+    location: str
+    usn: str
+    last_seen: float = 0.0
+
+
+def format_search(search_target=SEARCH_TARGET, mx=2, address=SSDP_ADDRESS):
+    return (f"M-SEARCH * HTTP/1.1\r\n"
+            f"Host: {address[0]}:{address[1]}\r\n"
+            f"Man: \"ssdp:discover\"\r\n"
+            f"ST: {search_target}\r\n"
+            f"MX: {mx}\r\n\r\n").encode("ascii")
+
+
+def parse_response(data, search_target=SEARCH_TARGET):
+    """Parse one SSDP reply; returns a DiscoveredDevice or None if it isn't a Roku."""
+    try:
+        lines = data.decode("utf-8", "replace").split("\r\n")
+    except AttributeError:
+        return None
+    if not lines or " 200 " not in lines[0] + " ":
+        return None
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    if headers.get("st", search_target) != search_target:
+        return None
+    location = headers.get("location", "")
+    usn = headers.get("usn", "")
+    url = urlparse(location)
+    if not url.hostname:
+        return None
+    # USN looks like "uuid:roku:ecp:<serial>".
+    serial = usn.rsplit(":", 1)[-1] if usn else url.hostname
+    return DiscoveredDevice(serial=serial, host=url.hostname, port=url.port or ECP_PORT,
+                            location=location, usn=usn, last_seen=time.time())
+
+
+class _SearchProtocol(asyncio.DatagramProtocol):
+    def __init__(self, search_target, on_device):
+        self.search_target = search_target
+        self.on_device = on_device
+
+    def datagram_received(self, data, addr):
+        device = parse_response(data, self.search_target)
+        if device is not None:
+            self.on_device(device)
+
+    def error_received(self, exc):
+        pass  # ICMP errors etc.; keep listening
+
+
+async def discover(timeout=DISCOVERY_TIMEOUT, search_target=SEARCH_TARGET,
+                   address=SSDP_ADDRESS, expected=None):
+    """
+    Search for Rokus and return {serial: DiscoveredDevice}.
+
+    Waits at most timeout seconds, or less if every serial in expected has
+    answered. address can point at a unicast responder for testing.
+    """
+    loop = asyncio.get_running_loop()
+    found = {}
+    done = asyncio.Event()
+    expected = set(expected or ())
+
+    def on_device(device):
+        found[device.serial] = device
+        if expected and expected.issubset(found):
+            done.set()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+    sock.bind(("", 0))
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _SearchProtocol(search_target, on_device), sock=sock)
+    try:
+        message = format_search(search_target, mx=max(1, int(timeout) - 1), address=address)
+        # UDP is lossy; send the search twice, a little apart.
+        transport.sendto(message, address)
+        try:
+            await asyncio.wait_for(done.wait(), min(0.5, timeout))
+        except asyncio.TimeoutError:
+            transport.sendto(message, address)
+            try:
+                await asyncio.wait_for(done.wait(), max(0.0, timeout - 0.5))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        transport.close()
+    return found
+
+
+def _default_registry_path():
+    return os.environ.get("DEVICE_REGISTRY") or os.path.join(
+        os.path.expanduser("~"), ".br-controller", "devices.json")
+
+
+class DeviceRegistry(object):
+    """
+    Persistent map of TV serial -> last known address, refreshed by SSDP.
+
+    Listeners added with add_listener() are called (on the ECP loop thread)
+    whenever a TV's address changes.
+    """
+    def __init__(self, path=None, interval=DISCOVERY_INTERVAL, timeout=DISCOVERY_TIMEOUT,
+                 address=SSDP_ADDRESS):
+        self.path = path or _default_registry_path()
+        self.interval = interval
+        self.timeout = timeout
+        self.address = address
+        self._lock = threading.Lock()
+        self._devices = {}   # serial -> DiscoveredDevice
+        self._aliases = {}   # configured IP -> serial last seen there
+        self._listeners = []
+        self._task = None
+        self._load()
+
+    # -- lookups --------------------------------------------------------
+    def devices(self):
+        with self._lock:
+            return sorted(self._devices.values(), key=lambda d: d.serial)
+
+    def resolve(self, host, serial=None):
+        """
+        Current address for a configured TV. serial wins if given and known;
+        otherwise a host that used to belong to a known TV follows that TV.
+        """
+        with self._lock:
+            serial = serial or self._aliases.get(host)
+            device = self._devices.get(serial) if serial else None
+        return device.host if device is not None else host
+
+    def remember(self, host, serial=None):
+        """Note that host is a configured TV so it can be followed if its IP changes."""
+        with self._lock:
+            if serial:
+                self._aliases[host] = serial
+                return
+            if self._aliases.get(host):
+                return
+            self._aliases[host] = None  # claimed by the next TV discovered there
+            for device in self._devices.values():
+                if device.host == host:
+                    self._aliases[host] = device.serial
+                    return
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    # -- discovery ------------------------------------------------------
+    def start(self):
+        """Start re-discovering in the background on the shared ECP loop. Idempotent."""
+        if os.environ.get("SSDP_DISCOVERY", "1") == "0":
+            return
+        loop = get_loop()
+        def schedule():
+            if self._task is None:
+                self._task = asyncio.ensure_future(self._run())
+        loop.call_soon_threadsafe(schedule)
+
+    def stop(self):
+        loop = get_loop()
+        def cancel():
+            if self._task is not None:
+                self._task.cancel()
+                self._task = None
+        loop.call_soon_threadsafe(cancel)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"SSDP discovery failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self):
+        """Run one discovery round and merge the results. Returns the devices found."""
+        found = await discover(self.timeout, address=self.address)
+        self.update(found.values())
+        return found
+
+    def update(self, devices):
+        moved = []
+        with self._lock:
+            for device in devices:
+                previous = self._devices.get(device.serial)
+                if previous is not None and previous.host != device.host:
+                    moved.append((device.serial, previous.host, device.host))
+                self._devices[device.serial] = device
+                # Unclaimed configured hosts learn which TV they point at.
+                for host, serial in list(self._aliases.items()):
+                    if serial is None and host == device.host:
+                        self._aliases[host] = device.serial
+            self._save()
+        for serial, old_host, new_host in moved:
+            print(f"TV {serial} moved from {old_host} to {new_host}")
+            for callback in self._listeners:
+                try:
+                    callback(serial, old_host, new_host)
+                except Exception as e:
+                    print(f"Error in device registry listener: {e}")
+
+    # -- persistence ----------------------------------------------------
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self._devices = {serial: DiscoveredDevice(**fields)
+                             for serial, fields in data.get("devices", {}).items()}
+            self._aliases = dict(data.get("aliases", {}))
+        except (OSError, ValueError, TypeError):
+            self._devices, self._aliases = {}, {}
+
+    def _save(self):
+        data = {
+            "devices": {serial: asdict(device) for serial, device in self._devices.items()},
+            "aliases": self._aliases,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomic(self.path, json.dumps(data, indent=1, sort_keys=True).encode("utf-8"))
+        except OSError as e:
+            print(f"Could not save device registry: {e}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Return the process-wide registry. Background discovery is started by
+    calling start() on it (a no-op when SSDP_DISCOVERY=0).
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DeviceRegistry()
+        return _registry
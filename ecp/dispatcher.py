@@ -0,0 +1,257 @@
+"""
+Background dispatch of ECP commands.
+
+Every TV gets its own FIFO queue and worker thread, so a slow or powered-off
+TV never blocks the caller and commands to the same TV are always sent in
+the order they were submitted. Commands to a TV whose circuit is open (see
+ecp/health.py) fail at once with a CircuitOpenError instead of being sent.
+
+Commands go out through the shared asyncio client, which keeps one
+keep-alive connection per TV and reports every answer to metrics and health.
+Commands that pile up for a TV while it is answering the previous one (fast
+taps) are sent together as a burst: pipelined back-to-back on that
+connection, so the burst costs about one round trip.
+Text (see TextEntry) is streamed the same way, one Lit_ keypress per
+character, with pacing.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import quote
+
+from ecp import metrics
+from ecp.client import get_client, run_sync
+from ecp.health import get_health
+
+MAX_BURST = 16  # most queued commands sent to one TV in a single pipelined burst
+TEXT_PACE = 0.025  # seconds between typed characters; Rokus can drop faster input
+TEXT_WINDOW = 4    # typed characters allowed in flight at once
+
+
+class CommandResult(object):
+    """Outcome of a single ECP command."""
+    def __init__(self, tv_ip, path, status=None, error=None, latency=0.0):
+        self.tv_ip = tv_ip
+        self.path = path
+        self.status = status
+        self.error = error
+        self.latency = latency  # seconds
+
+    @property
+    def ok(self):
+        return self.error is None and self.status == 200
+
+    def to_json(self):
+        return {
+            "tv_ip": self.tv_ip,
+            "path": self.path,
+            "ok": self.ok,
+            "status": self.status,
+            "error": str(self.error) if self.error is not None else None,
+            "latency_ms": round(self.latency * 1000, 1),
+        }
+
+    def __repr__(self):
+        return (f"CommandResult(tv_ip={self.tv_ip!r}, path={self.path!r}, "
+                f"status={self.status!r}, error={self.error!r}, latency={self.latency:.3f})")
+
+
+class TextEntry(object):
+    """
+    Text to type into whatever text field has focus on the TV (e.g. an app's
+    search box), as one /keypress/Lit_<char> per character.
+
+    Pass it to submit() or broadcast() in place of a path. The keypresses are
+    streamed on one connection, pace seconds apart with at most window of them
+    unanswered, and the result is a single CommandResult for the whole text.
+    """
+    def __init__(self, text, pace=TEXT_PACE, window=TEXT_WINDOW):
+        self.text = text
+        self.pace = pace
+        self.window = window
+
+    def paths(self):
+        return [f"keypress/Lit_{quote(char, safe='')}" for char in self.text]
+
+    def __str__(self):
+        return f"text/{quote(self.text, safe='')}"
+
+    def __repr__(self):
+        return f"TextEntry({self.text!r})"
+
+
+class CommandDispatcher(object):
+    """
+    Send ECP commands from per-TV worker threads.
+
+    submit() only enqueues and returns a Future; the optional callback is
+    invoked with the CommandResult on the worker thread, so UI code must hop
+    back to its own thread (e.g. via Clock.schedule_once).
+    """
+    def __init__(self, timeout=None, health=None, client=None, max_burst=MAX_BURST):
+        self.timeout = timeout  # None means the client's configured timeouts
+        self.health = health or get_health()
+        self.client = client    # None means the shared asyncio client
+        self.max_burst = max_burst
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, tv_ip, path, callback=None):
+        """
+        Queue a POST to http://<tv_ip>:8060/<path>, or the keypresses for a
+        TextEntry. If tv_ip's circuit is open the command is failed (and callback
+        called) right here, without queueing it.
+        """
+        future = Future()
+        if not self.health.allow(tv_ip):
+            self._finish(future, callback, self._rejected(tv_ip, str(path)))
+            return future
+        self._queue_for(tv_ip).put((path, future, callback))
+        return future
+
+    def broadcast(self, tv_ips, path, callback=None):
+        """
+        Queue the same command for several TVs at once.
+
+        Each TV's worker sends it in parallel (and still in order with that
+        TV's other commands), so the whole broadcast takes about as long as
+        the slowest TV. callback gets each CommandResult as it arrives; the
+        returned Future resolves to {tv_ip: CommandResult} once all are done.
+        """
+        tv_ips = list(dict.fromkeys(tv_ips))
+        combined = Future()
+        results = {}
+        lock = threading.Lock()
+        if not tv_ips:
+            combined.set_result(results)
+            return combined
+        def collect(result):
+            with lock:
+                results[result.tv_ip] = result
+                finished = len(results) == len(tv_ips)
+            if finished:
+                combined.set_result(results)
+            if callback is not None:
+                callback(result)
+        for tv_ip in tv_ips:
+            self.submit(tv_ip, path, callback=collect)
+        return combined
+
+    def queue_depths(self):
+        """{(tv_ip,): depth} for every TV with a queue, for the ecp_queue_depth gauge."""
+        with self._lock:
+            queues = list(self._queues.items())
+        return {(tv_ip,): q.qsize() for tv_ip, q in queues}
+
+    def stop(self):
+        """Tell every worker to exit once its queue is drained."""
+        with self._lock:
+            queues, self._queues = self._queues, {}
+        for q in queues.values():
+            q.put(None)
+
+    def _queue_for(self, tv_ip):
+        with self._lock:
+            q = self._queues.get(tv_ip)
+            if q is None:
+                q = queue.Queue()
+                self._queues[tv_ip] = q
+                worker = threading.Thread(target=self._worker, args=(tv_ip, q),
+                                          name=f"ecp-{tv_ip}")
+                worker.daemon = True
+                worker.start()
+            return q
+
+    def _worker(self, tv_ip, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            burst = [item]
+            while len(burst) < self.max_burst and not isinstance(burst[-1][0], TextEntry):
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    q.put(None)  # exit once this burst is sent
+                    break
+                burst.append(item)
+            # Text goes out on its own stream, after any commands queued before it.
+            text = burst.pop() if isinstance(burst[-1][0], TextEntry) else None
+            if burst:
+                results = self._send_burst(tv_ip, [path for path, _, _ in burst])
+                for (path, future, callback), result in zip(burst, results):
+                    self._finish(future, callback, result)
+            if text is not None:
+                entry, future, callback = text
+                self._finish(future, callback, self._send_text(tv_ip, entry))
+
+    def _finish(self, future, callback, result):
+        future.set_result(result)
+        if callback is not None:
+            try:
+                callback(result)
+            except Exception as e:
+                print(f"Error in ECP callback for '{result.path}': {e}")
+
+    def _rejected(self, tv_ip, path):
+        metrics.request_errors.inc(tv=tv_ip, endpoint=metrics.endpoint_of(path),
+                                   error="circuit_open")
+        return CommandResult(tv_ip, path, error=self.health.reject(tv_ip))
+
+    def _send_text(self, tv_ip, entry):
+        """Type a TextEntry on tv_ip; one CommandResult for the lot, failed if any key failed."""
+        if not self.health.allow(tv_ip):
+            return self._rejected(tv_ip, str(entry))
+        start = time.monotonic()
+        results = self._send_burst(tv_ip, entry.paths(), entry.pace, entry.window)
+        failed = [result for result in results if not result.ok]
+        if failed:
+            return CommandResult(tv_ip, str(entry), status=failed[0].status,
+                                 error=failed[0].error, latency=time.monotonic() - start)
+        return CommandResult(tv_ip, str(entry), status=200, latency=time.monotonic() - start)
+
+    def _send_burst(self, tv_ip, paths, pace=0.0, window=None):
+        """
+        Send paths to tv_ip on its keep-alive connection, pipelined if there are
+        several; returns a CommandResult for each.
+        """
+        if not paths:
+            return []
+        if not self.health.allow(tv_ip):
+            return [self._rejected(tv_ip, path) for path in paths]
+        client = self.client or get_client()
+        start = time.monotonic()
+        try:
+            # The client times each answer and reports it to metrics and health itself.
+            responses = run_sync(client.pipeline(
+                tv_ip, "POST", [f"/{path.lstrip('/')}" for path in paths], timeout=self.timeout,
+                pace=pace, window=window))
+        except Exception as e:
+            responses = [e] * len(paths)
+        results = []
+        for path, response in zip(paths, responses):
+            if isinstance(response, Exception):
+                results.append(CommandResult(tv_ip, path, error=response,
+                                             latency=time.monotonic() - start))
+            else:
+                results.append(CommandResult(tv_ip, path, status=response.status,
+                                             latency=response.elapsed))
+        return results
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the process-wide dispatcher, creating it on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = CommandDispatcher()
+            metrics.gauge("ecp_queue_depth", "Commands waiting to be sent, per TV.",
+                          ("tv",), function=_dispatcher.queue_depths)
+        return _dispatcher
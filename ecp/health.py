@@ -0,0 +1,216 @@
+"""
+Per-TV health tracking with a circuit breaker.
+
+Every ECP request (from the dispatcher or the asyncio client) reports its
+outcome here. A TV that answers is healthy; one that answers slowly, or
+has just failed, is degraded; after FAILURE_THRESHOLD failures in a row
+its circuit opens. While the circuit is open the dispatcher fails commands
+to that TV at once instead of waiting out another connection attempt, and
+a background probe (/query/device-info) retries the TV with exponential
+backoff. The first request that gets an answer closes the circuit again.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from ecp import metrics
+
+HEALTHY = "healthy"
+DEGRADED = "degraded"
+OPEN = "open"
+STATE_CODES = {HEALTHY: 0, DEGRADED: 1, OPEN: 2}  # for the ecp_tv_health gauge
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+FAILURE_THRESHOLD = _env_int("ECP_CIRCUIT_FAILURES", 3)  # failures in a row that open it
+DEGRADED_LATENCY = 1.0   # seconds; a TV averaging slower than this is degraded
+LATENCY_SMOOTHING = 0.3  # weight of the newest sample in the latency average
+BACKOFF_BASE = 2.0       # seconds before the first probe of an open circuit
+BACKOFF_MAX = 60.0       # longest wait between probes
+PROBE_TIMEOUT = 2.0      # seconds a probe waits for /query/device-info
+
+
+class CircuitOpenError(Exception):
+    """A command was not sent because the TV's circuit is open."""
+
+
+class DeviceHealth(object):
+    """What is known about one TV's recent behaviour."""
+    def __init__(self, tv_ip):
+        self.tv_ip = tv_ip
+        self.state = HEALTHY
+        self.failures = 0          # in a row
+        self.latency = None        # smoothed seconds, from answered requests only
+        self.last_error = None
+        self.backoff = 0.0         # seconds until the next probe, while open
+        self.retry_at = None       # time.time() of the next probe, while open
+        self.changed_at = time.time()
+
+    def to_json(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "last_error": self.last_error,
+            "retry_at": self.retry_at,
+            "changed_at": self.changed_at,
+        }
+
+
+class HealthTracker(object):
+    """
+    Thread-safe per-TV health state machine.
+
+    Listeners added with add_listener() are called as callback(tv_ip, health)
+    on whichever thread reported the outcome, whenever a TV changes state.
+    """
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, degraded_latency=DEGRADED_LATENCY,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, probe=True):
+        self.failure_threshold = failure_threshold
+        self.degraded_latency = degraded_latency
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.probe = probe
+        self._devices = {}
+        self._listeners = []
+        self._probing = set()
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        with self._lock:
+            self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        with self._lock:
+            self._listeners = [cb for cb in self._listeners if cb is not callback]
+
+    def get(self, tv_ip):
+        """The DeviceHealth for tv_ip; TVs never heard from are healthy."""
+        with self._lock:
+            return self._devices.get(tv_ip) or DeviceHealth(tv_ip)
+
+    def state(self, tv_ip):
+        return self.get(tv_ip).state
+
+    def allow(self, tv_ip):
+        """False while tv_ip's circuit is open, i.e. commands should fail fast."""
+        with self._lock:
+            device = self._devices.get(tv_ip)
+            return device is None or device.state != OPEN
+
+    def reject(self, tv_ip):
+        """The CircuitOpenError to fail a command to tv_ip with."""
+        device = self.get(tv_ip)
+        wait = max(0, (device.retry_at or time.time()) - time.time())
+        return CircuitOpenError(f"{tv_ip} is unreachable ({device.last_error}); "
+                                f"retrying in {wait:.0f}s")
+
+    def record(self, tv_ip, ok, latency=None, error=None):
+        """
+        Report one request: ok means the TV answered (whatever the HTTP status),
+        otherwise error says why not (a timeout, a refused connection, ...).
+        """
+        with self._lock:
+            device = self._devices.get(tv_ip)
+            if device is None:
+                device = self._devices[tv_ip] = DeviceHealth(tv_ip)
+            old_state = device.state
+            if ok:
+                device.failures = 0
+                device.backoff = 0.0
+                device.retry_at = None
+                if latency is not None:
+                    device.latency = (latency if device.latency is None else
+                                      LATENCY_SMOOTHING * latency
+                                      + (1 - LATENCY_SMOOTHING) * device.latency)
+                slow = device.latency is not None and device.latency > self.degraded_latency
+                device.state = DEGRADED if slow else HEALTHY
+            else:
+                device.failures += 1
+                device.last_error = str(error) if error is not None else "no answer"
+                if device.state != OPEN:
+                    if device.failures >= self.failure_threshold:
+                        device.state = OPEN
+                        device.backoff = self.backoff_base
+                        device.retry_at = time.time() + device.backoff
+                    else:
+                        device.state = DEGRADED
+            if device.state == old_state:
+                return device
+            device.changed_at = time.time()
+            listeners = self._listeners
+            start_probe = device.state == OPEN and self.probe and tv_ip not in self._probing
+            if start_probe:
+                self._probing.add(tv_ip)
+        print(f"TV {tv_ip}: {old_state} -> {device.state}")
+        if start_probe:
+            self._start_probe(tv_ip)
+        for callback in listeners:
+            try:
+                callback(tv_ip, device)
+            except Exception as e:
+                print(f"Error in health listener: {e}")
+        return device
+
+    def snapshot(self, tv_ips=None):
+        """JSON-ready dict of tv_ip -> health."""
+        with self._lock:
+            devices = list(self._devices.values())
+        return {device.tv_ip: device.to_json() for device in devices
+                if tv_ips is None or device.tv_ip in tv_ips}
+
+    def state_codes(self):
+        """{(tv_ip,): 0, 1 or 2} (healthy, degraded, open), for the ecp_tv_health gauge."""
+        with self._lock:
+            return {(tv_ip,): STATE_CODES[device.state] for tv_ip, device in self._devices.items()}
+
+    # -- background probing ---------------------------------------------
+    def _start_probe(self, tv_ip):
+        # Imported here: the client reports to this module, so it can't be imported at the top.
+        from ecp.client import get_loop
+        get_loop().call_soon_threadsafe(self._schedule_probe, tv_ip)
+
+    def _schedule_probe(self, tv_ip):
+        device = self.get(tv_ip)
+        if device.state != OPEN:
+            with self._lock:
+                self._probing.discard(tv_ip)
+            return
+        delay = max(0.0, (device.retry_at or 0) - time.time())
+        asyncio.get_running_loop().call_later(delay, lambda: asyncio.ensure_future(self._probe(tv_ip)))
+
+    async def _probe(self, tv_ip):
+        from ecp.client import get_client
+        try:
+            # The client reports the outcome itself; an answer closes the circuit.
+            await asyncio.wait_for(get_client().device_info(tv_ip), PROBE_TIMEOUT)
+        except Exception as e:
+            with self._lock:
+                device = self._devices.get(tv_ip)
+                if device is not None and device.state == OPEN:
+                    device.backoff = min(self.backoff_max, device.backoff * 2)
+                    device.retry_at = time.time() + device.backoff
+                    device.last_error = str(e) or type(e).__name__
+        self._schedule_probe(tv_ip)
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_health():
+    """Return the process-wide HealthTracker."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = HealthTracker()
+            metrics.gauge("ecp_tv_health", "TV health: 0 healthy, 1 degraded, 2 circuit open.",
+                          ("tv",), function=_tracker.state_codes)
+        return _tracker
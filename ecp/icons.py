@@ -0,0 +1,330 @@
+"""
+App icon cache and downloads that never block the caller.
+
+Icons are stored per source TV in an icon directory, alongside a small
+index.json recording where each came from, its size, when it was fetched
+and a content hash. Icons are stored as thumbnails scaled to the size the
+kiosk draws them at (the full-size original is kept only if asked). The
+directory is kept under a size limit by evicting the least recently used
+icons, old entries are revalidated in the background, and every file is
+written through a temp file and renamed into place so a partial download
+is never served.
+
+Downloads run on the shared ECP loop; concurrent requests for the same icon
+share a single in-flight fetch.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+from ecp import metrics, write_atomic
+from ecp.client import get_client, get_loop, run_sync
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_size(name, default):
+    try:
+        width, height = os.environ.get(name, "").lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        return default
+
+
+# Leading bytes of the image formats Rokus serve icons in.
+IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF8")
+
+# Roughly the size of an app icon slot on the 800x480 kiosk.
+ICON_SIZE = (150, 70)
+
+_warned_no_pillow = False
+
+icon_lookups = metrics.counter("icon_cache_lookups_total",
+                               "App icon lookups in the on-disk cache, by result.", ("result",))
+
+
+def make_thumbnail(data, size):
+    """
+    Return data scaled down (keeping its aspect ratio) to fit within size, as
+    PNG bytes. Returns None if Pillow is missing, the image can't be decoded,
+    or it already fits.
+    """
+    global _warned_no_pillow
+    try:
+        # Imported on first use: Pillow is slow to import and only needed for downloads.
+        from PIL import Image as PILImage
+    except ImportError:
+        if not _warned_no_pillow:
+            _warned_no_pillow = True
+            print("Pillow not found. App icons will be cached at full size.")
+        return None
+    try:
+        image = PILImage.open(io.BytesIO(data))
+        if image.width <= size[0] and image.height <= size[1]:
+            return None
+        image = image.convert("RGBA")
+        image.thumbnail(size, PILImage.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format="PNG", optimize=True)
+        return out.getvalue()
+    except Exception as e:
+        print(f"Could not scale icon: {e}")
+        return None
+
+
+class IconCache(object):
+    """
+    On-disk icon store keyed by (tv_ip, app_id).
+
+    max_bytes defaults to ICON_CACHE_MAX_BYTES (20 MB) and revalidate_after
+    to ICON_REVALIDATE_AFTER (7 days, in seconds). Icons are scaled to fit
+    ICON_THUMB_SIZE (e.g. "150x70") times ICON_THUMB_SCALE (1, or 2 for
+    high-DPI panels); set ICON_KEEP_ORIGINAL=1 to also keep the full-size file.
+    """
+    INDEX_NAME = "index.json"
+    SAVE_DELAY = 2.0  # seconds; index changes made meanwhile are written together
+
+    def __init__(self, icon_dir, max_bytes=None, revalidate_after=None,
+                 thumb_size=None, keep_original=None):
+        self.icon_dir = icon_dir
+        if max_bytes is None:
+            max_bytes = _env_int("ICON_CACHE_MAX_BYTES", 20 * 1024 * 1024)
+        if revalidate_after is None:
+            revalidate_after = _env_int("ICON_REVALIDATE_AFTER", 7 * 24 * 3600)
+        if thumb_size is None:
+            width, height = _env_size("ICON_THUMB_SIZE", ICON_SIZE)
+            scale = max(1, _env_int("ICON_THUMB_SCALE", 1))
+            thumb_size = (width * scale, height * scale)
+        if keep_original is None:
+            keep_original = os.environ.get("ICON_KEEP_ORIGINAL", "0") == "1"
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.thumb_size = thumb_size
+        self.keep_original = keep_original
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # keeps index writes in order
+        self._dirty = False
+        self._save_timer = None
+        os.makedirs(icon_dir, exist_ok=True)
+        self._index = self._load_index()
+        self._sweep()
+
+    @staticmethod
+    def key(tv_ip, app_id):
+        return f"{tv_ip}/{app_id}"
+
+    def path_for(self, tv_ip, app_id, suffix=""):
+        """File an icon is (or would be) stored in."""
+        device = str(tv_ip).replace(".", "_").replace(":", "_")
+        return os.path.join(self.icon_dir, f"app{app_id}_{device}{suffix}.png")
+
+    def lookup(self, tv_ip, app_id):
+        """Return the path of a valid cached icon and mark it used, or None."""
+        key = self.key(tv_ip, app_id)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                icon_lookups.inc(result="miss")
+                return None
+            path = os.path.join(self.icon_dir, entry["file"])
+            try:
+                valid = os.path.getsize(path) == entry["size"]
+            except OSError:
+                valid = False
+            if not valid:
+                # Missing or truncated on disk; forget it so it is fetched again.
+                del self._index[key]
+                self._save_index()
+                icon_lookups.inc(result="miss")
+                return None
+            entry["last_used"] = time.time()
+            self._save_index()
+            icon_lookups.inc(result="hit")
+            return path
+
+    def needs_revalidation(self, tv_ip, app_id):
+        with self._lock:
+            entry = self._index.get(self.key(tv_ip, app_id))
+        return entry is not None and time.time() - entry["fetched_at"] > self.revalidate_after
+
+    def store(self, tv_ip, app_id, data, content_type=""):
+        """
+        Atomically save an icon (as a thumbnail if it is larger than thumb_size),
+        record it in the index and enforce the size limit. The hash is of the
+        original download, so revalidating an unchanged icon rewrites nothing.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(tv_ip, app_id)
+        original_path = self.path_for(tv_ip, app_id, "_orig") if self.keep_original else None
+        key = self.key(tv_ip, app_id)
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(key)
+            if (entry is not None and entry["sha256"] == digest and os.path.exists(path)
+                    and (entry.get("original") or not entry.get("thumbnail")
+                         or not self.keep_original)):
+                entry["fetched_at"] = entry["last_used"] = now
+                self._save_index()
+                return path
+        # Scaling can take a moment on a Pi; do it outside the lock.
+        thumbnail = make_thumbnail(data, self.thumb_size)
+        stored = thumbnail if thumbnail is not None else data
+        with self._lock:
+            write_atomic(path, stored)
+            if original_path and thumbnail is not None:
+                write_atomic(original_path, data)
+            else:
+                original_path = None
+            self._index[key] = {
+                "file": os.path.basename(path),
+                "original": os.path.basename(original_path) if original_path else None,
+                "device": str(tv_ip),
+                "app_id": str(app_id),
+                "size": len(stored),
+                "original_size": len(data),
+                "thumbnail": thumbnail is not None,
+                "sha256": digest,
+                "content_type": content_type,
+                "fetched_at": now,
+                "last_used": now,
+            }
+            self._evict()
+            self._save_index()
+        return path
+
+    @staticmethod
+    def _disk_size(entry):
+        original = entry["original_size"] if entry.get("original") else 0
+        return entry["size"] + original
+
+    def _evict(self):
+        total = sum(self._disk_size(entry) for entry in self._index.values())
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            self._remove_file(entry["file"])
+            if entry.get("original"):
+                self._remove_file(entry["original"])
+            del self._index[key]
+            total -= self._disk_size(entry)
+
+    def _sweep(self):
+        """Delete temp files left behind by writes that were interrupted."""
+        for name in os.listdir(self.icon_dir):
+            if name.endswith(".tmp"):
+                self._remove_file(name)
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.icon_dir, name))
+        except OSError:
+            pass
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.icon_dir, self.INDEX_NAME)) as f:
+                index = json.load(f)
+            return index if isinstance(index, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        """
+        Mark the index changed (the caller holds the lock) and write it from a
+        background thread SAVE_DELAY seconds later, so lookups on the UI thread
+        never wait for the disk and a screenful of them costs one write.
+        """
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.SAVE_DELAY, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Write the index now if it has unsaved changes."""
+        with self._save_lock:
+            with self._lock:
+                self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = json.dumps(self._index, indent=1, sort_keys=True).encode("utf-8")
+            try:
+                write_atomic(os.path.join(self.icon_dir, self.INDEX_NAME), data)
+            except OSError as e:
+                print(f"Could not save the icon index: {e}")
+
+
+class IconLoader(object):
+    """Fetch app icons into an IconCache, one download per icon at a time."""
+    def __init__(self, icon_dir, client=None, cache=None):
+        self.cache = cache or IconCache(icon_dir)
+        self.client = client or get_client()
+        self._inflight = {}  # cache key -> asyncio.Task, only touched on the loop
+
+    def cached(self, app_id, tv_ip):
+        """Return the icon's path if it is already cached, otherwise None."""
+        return self.cache.lookup(tv_ip, app_id)
+
+    def load(self, app_id, tv_ip, callback):
+        """
+        Start fetching an icon and return immediately.
+        callback(path_or_None) runs on the ECP loop thread once it is done.
+        """
+        future = asyncio.run_coroutine_threadsafe(self.fetch(app_id, tv_ip), get_loop())
+        def done(f):
+            ok = not f.cancelled() and f.exception() is None
+            callback(f.result() if ok else None)
+        future.add_done_callback(done)
+        return future
+
+    def get(self, app_id, tv_ip):
+        """Blocking variant of load(); returns the icon path or None."""
+        return run_sync(self.fetch(app_id, tv_ip))
+
+    async def fetch(self, app_id, tv_ip):
+        """
+        Coroutine returning the icon path (or None), joining any fetch already
+        running. A cached icon due for revalidation is returned as-is while a
+        fresh copy is fetched in the background.
+        """
+        path = self.cache.lookup(tv_ip, app_id)
+        if path:
+            if self.cache.needs_revalidation(tv_ip, app_id):
+                self._download_task(app_id, tv_ip)
+            return path
+        # Shield the shared download so one cancelled waiter doesn't cancel it for all.
+        return await asyncio.shield(self._download_task(app_id, tv_ip))
+
+    def _download_task(self, app_id, tv_ip):
+        key = self.cache.key(tv_ip, app_id)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._download(app_id, tv_ip))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None))
+        return task
+
+    async def _download(self, app_id, tv_ip):
+        print(f"Fetching icon {app_id} from: {tv_ip}")
+        try:
+            icon = await self.client.icon(tv_ip, app_id)
+        except Exception as e:
+            print(f"Icon failed to save: {e}")
+            return None
+        if not icon.data.startswith(IMAGE_SIGNATURES):
+            print(f"Icon {app_id} from {tv_ip} is not an image; not caching it")
+            return None
+        path = await asyncio.get_running_loop().run_in_executor(
+            None, self.cache.store, tv_ip, app_id, icon.data, icon.content_type)
+        print(f"Saved icon to file: {path}")
+        return path
@@ -0,0 +1,226 @@
+"""
+Background polling of TV state into an in-process cache.
+
+A single DevicePoller refreshes active-app, device-info and the installed
+app list for every tracked TV, each on its own interval, and stores the
+results in a StateCache. The admin pages and the kiosk read from the cache
+instead of querying the TVs themselves, and can subscribe to be told when
+a TV's state changes. TVs whose circuit is open (see ecp/health.py) are not
+polled; the health probe finds out when they are back.
+"""
+import asyncio
+import dataclasses
+import threading
+import time
+
+from ecp import metrics
+from ecp.client import get_client, get_loop
+from ecp.health import get_health
+
+# How often (seconds) each kind of state is refreshed. Entries older than
+# TTL_FACTOR intervals are treated as stale.
+POLL_INTERVALS = {
+    "active_app": 5,
+    "device_info": 60,
+    "apps": 300,
+}
+TTL_FACTOR = 3
+# How often (seconds) a skipped poll of a TV with an open circuit is retried.
+OPEN_CIRCUIT_RECHECK = 5
+
+
+class CacheEntry(object):
+    """One cached query result (or the error it raised) with its timestamp."""
+    def __init__(self, value=None, error=None, ttl=0):
+        self.value = value
+        self.error = error
+        self.ttl = ttl
+        self.fetched_at = time.time()
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+    @property
+    def fresh(self):
+        return self.error is None and self.age <= self.ttl
+
+    def to_json(self):
+        return {
+            "value": _jsonable(self.value),
+            "error": str(self.error) if self.error is not None else None,
+            "fetched_at": self.fetched_at,
+            "age": round(self.age, 3),
+            "fresh": self.fresh,
+        }
+
+
+class StateCache(object):
+    """
+    Thread-safe map of (tv_ip, kind) -> CacheEntry.
+
+    Listeners added with add_listener() are called as callback(tv_ip, kind, entry)
+    whenever a value changes or a TV starts or stops answering; re-fetching an
+    unchanged value notifies no one.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        with self._lock:
+            self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        with self._lock:
+            self._listeners = [cb for cb in self._listeners if cb is not callback]
+
+    def set(self, tv_ip, kind, value=None, error=None, ttl=0):
+        entry = CacheEntry(value, error, ttl)
+        with self._lock:
+            previous = self._entries.get((tv_ip, kind))
+            if error is not None and previous is not None and previous.error is None:
+                # Keep the last good value around so callers can still show it.
+                entry.value = previous.value
+            self._entries[(tv_ip, kind)] = entry
+            changed = (previous is None
+                       or (previous.error is None) != (error is None)
+                       or previous.value != entry.value)
+            listeners = self._listeners if changed else []
+        for callback in listeners:
+            try:
+                callback(tv_ip, kind, entry)
+            except Exception as e:
+                print(f"Error in state cache listener: {e}")
+        return entry
+
+    def get(self, tv_ip, kind):
+        """Return the CacheEntry for tv_ip/kind, or None if never fetched."""
+        with self._lock:
+            return self._entries.get((tv_ip, kind))
+
+    def value(self, tv_ip, kind):
+        """Return the cached value if it is fresh, otherwise None."""
+        entry = self.get(tv_ip, kind)
+        return entry.value if entry is not None and entry.fresh else None
+
+    def reachable(self, kind="active_app"):
+        """{(tv_ip,): 1 or 0} by whether the last kind query answered, for the ecp_tv_up gauge."""
+        with self._lock:
+            return {(tv_ip,): int(entry.error is None)
+                    for (tv_ip, entry_kind), entry in self._entries.items() if entry_kind == kind}
+
+    def snapshot(self, tv_ips=None):
+        """JSON-ready dict of tv_ip -> kind -> entry."""
+        with self._lock:
+            items = list(self._entries.items())
+        status = {}
+        for (tv_ip, kind), entry in items:
+            if tv_ips is None or tv_ip in tv_ips:
+                status.setdefault(tv_ip, {})[kind] = entry.to_json()
+        return status
+
+
+def _jsonable(value):
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    if isinstance(value, list):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+class DevicePoller(object):
+    """
+    Keep a StateCache up to date for a set of TVs.
+
+    Several parts of the app can ask for TVs to be polled; each registers its
+    own list with track(owner, tv_ips) and the poller follows the union.
+    """
+    def __init__(self, cache=None, client=None, intervals=None, health=None):
+        self.cache = cache or StateCache()
+        self.client = client or get_client()
+        self.health = health or get_health()
+        self.intervals = dict(intervals or POLL_INTERVALS)
+        self._owners = {}
+        self._tasks = {}   # (tv_ip, kind) -> asyncio.Task, only touched on the loop
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def start(self):
+        """Start polling on the shared ECP loop. Safe to call more than once."""
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._loop = get_loop()
+        self._loop.call_soon_threadsafe(self._sync_tasks)
+
+    def stop(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(self._cancel_all)
+
+    def track(self, owner, tv_ips):
+        """Set the TVs polled on behalf of owner (e.g. "kiosk" or "admin")."""
+        tv_ips = {ip for ip in tv_ips if ip}
+        with self._lock:
+            if self._owners.get(owner) == tv_ips:
+                return
+            self._owners[owner] = tv_ips
+            loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._sync_tasks)
+
+    def tracked(self):
+        with self._lock:
+            return set().union(*self._owners.values()) if self._owners else set()
+
+    def _sync_tasks(self):
+        wanted = {(tv_ip, kind) for tv_ip in self.tracked() for kind in self.intervals}
+        for key in list(self._tasks):
+            if key not in wanted:
+                self._tasks.pop(key).cancel()
+        for key in wanted:
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.ensure_future(self._poll(*key))
+
+    def _cancel_all(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def _poll(self, tv_ip, kind):
+        interval = self.intervals[kind]
+        fetch = getattr(self.client, kind)
+        while True:
+            if not self.health.allow(tv_ip):
+                # A query would just hang for its whole timeout, holding a connection slot.
+                self.cache.set(tv_ip, kind, error=self.health.reject(tv_ip),
+                               ttl=interval * TTL_FACTOR)
+                await asyncio.sleep(min(interval, OPEN_CIRCUIT_RECHECK))
+                continue
+            try:
+                value = await fetch(tv_ip)
+                self.cache.set(tv_ip, kind, value=value, ttl=interval * TTL_FACTOR)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.cache.set(tv_ip, kind, error=e, ttl=interval * TTL_FACTOR)
+            await asyncio.sleep(interval)
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_poller():
+    """Return the process-wide poller, started on first use."""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = DevicePoller()
+            _poller.start()
+            metrics.gauge("ecp_tv_up", "1 if the TV answered its last active-app poll.",
+                          ("tv",), function=_poller.cache.reachable)
+        return _poller
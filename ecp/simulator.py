@@ -0,0 +1,310 @@
+"""
+Simulated Roku TVs for development and load testing.
+
+Runs any number of virtual TVs on one asyncio loop, each answering the ECP
+endpoints this project uses: keypress, keydown/keyup, launch, query/apps,
+query/active-app, query/icon and query/device-info. Every TV has its own
+state (active app, key presses seen) and can be given latency, jitter, an
+error rate (503 replies), a drop rate (connection closed without a reply),
+a hang rate (never answered, like a TV that has dropped off the network)
+and an app catalog of any size.
+
+TVs listen either on consecutive loopback addresses at port 8060 (Linux
+routes all of 127/8 to loopback), so they look exactly like real TVs, or on
+consecutive ports of one address, which the kiosk and admin accept as
+"host:port" TV addresses.
+
+    python -m ecp.simulator --count 200 --host 127.0.1.1 --latency 0.02 --env
+
+prints TVnn_IP lines for the .env and serves until interrupted.
+"""
+import argparse
+import asyncio
+import glob
+import ipaddress
+import os
+import random
+import threading
+import time
+from urllib.parse import unquote
+
+from ecp import ECP_PORT
+
+ICON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "icons")
+
+# Real channel IDs first, so configs written for real TVs find their apps.
+KNOWN_APPS = [("12", "Netflix"), ("13", "Prime Video"), ("837", "YouTube"),
+              ("61322", "HBO Max"), ("2285", "Hulu"), ("291097", "Disney Plus")]
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+def make_catalog(size):
+    """[(app_id, name)] with the well-known apps first, padded with numbered ones."""
+    apps = KNOWN_APPS[:size]
+    for i in range(len(apps), size):
+        apps.append((str(100000 + i), f"Channel {i:04d}"))
+    return apps
+
+
+def _load_icons():
+    icons = []
+    for path in sorted(glob.glob(os.path.join(ICON_DIR, "*.png"))):
+        with open(path, "rb") as f:
+            icons.append(f.read())
+    return icons or [b"\x89PNG\r\n\x1a\n"]
+
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+class VirtualTV(object):
+    """State and behaviour of one simulated TV."""
+    def __init__(self, number, host, port=ECP_PORT, apps=None, latency=0.0, jitter=0.0,
+                 error_rate=0.0, drop_rate=0.0, hang_rate=0.0, icons=None, seed=None):
+        self.number = number
+        self.host = host
+        self.port = port
+        self.serial = f"SIM{number:06d}"
+        self.apps = apps if apps is not None else make_catalog(len(KNOWN_APPS))
+        self._app_ids = {app_id for app_id, _ in self.apps}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.hang_rate = hang_rate
+        self.icons = icons or _load_icons()
+        self.random = random.Random(seed if seed is not None else number)
+        self.active_app = None   # None is the home screen
+        self.held_keys = set()
+        self.requests = 0
+        self.keypresses = []
+        self.typed = ""          # text entered with Lit_ keypresses
+        self.writers = set()  # open connections, closed by Simulator.stop()
+        self._apps_xml = ("<apps>" + "".join(
+            f'<app id="{app_id}" type="appl" version="1.0.0">{_escape(name)}</app>'
+            for app_id, name in self.apps) + "</apps>").encode()
+
+    @property
+    def address(self):
+        """How the kiosk and admin should refer to this TV."""
+        return self.host if self.port == ECP_PORT else f"{self.host}:{self.port}"
+
+    def delay(self):
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def handle(self, method, path):
+        """Return (status, content_type, body) for one request."""
+        path = path.split("?", 1)[0]
+        parts = [part for part in path.split("/") if part]
+        if method == "POST" and len(parts) == 2 and parts[0] in ("keypress", "keydown", "keyup"):
+            return self._key(parts[0], parts[1])
+        if method == "POST" and len(parts) == 2 and parts[0] == "launch":
+            if parts[1] not in self._app_ids:
+                return 404, "text/plain", b""
+            self.active_app = parts[1]
+            return 200, "text/plain", b""
+        if method == "GET" and parts[:1] == ["query"]:
+            return self._query(parts[1:])
+        return 404, "text/plain", b""
+
+    def _key(self, action, key):
+        if action == "keydown":
+            self.held_keys.add(key)
+        elif action == "keyup":
+            self.held_keys.discard(key)
+        else:
+            self.keypresses.append(key)
+            if key == "Home":
+                self.active_app = None
+            elif key.startswith("Lit_"):
+                self.typed += unquote(key[len("Lit_"):])
+        return 200, "text/plain", b""
+
+    def _query(self, parts):
+        if parts == ["apps"]:
+            return 200, "text/xml", self._apps_xml
+        if parts == ["active-app"]:
+            if self.active_app is None:
+                body = "<active-app><app>Roku</app></active-app>"
+            else:
+                name = dict(self.apps)[self.active_app]
+                body = f'<active-app><app id="{self.active_app}">{_escape(name)}</app></active-app>'
+            return 200, "text/xml", body.encode()
+        if parts == ["device-info"]:
+            body = (f"<device-info><serial-number>{self.serial}</serial-number>"
+                    f"<model-name>Simulated Roku</model-name>"
+                    f"<friendly-device-name>Simulated TV {self.number}</friendly-device-name>"
+                    f"<software-version>11.0.0</software-version>"
+                    f"<power-mode>PowerOn</power-mode><network-type>ethernet</network-type>"
+                    f"</device-info>")
+            return 200, "text/xml", body.encode()
+        if len(parts) == 2 and parts[0] == "icon":
+            if parts[1] not in self._app_ids:
+                return 404, "text/plain", b""
+            return 200, "image/png", self.icons[sum(parts[1].encode()) % len(self.icons)]
+        return 404, "text/plain", b""
+
+    async def serve_connection(self, reader, writer):
+        """Answer HTTP/1.1 requests on one keep-alive connection."""
+        self.writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                try:
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                await asyncio.sleep(self.delay())
+                roll = self.random.random()
+                if roll < self.hang_rate:
+                    await reader.read()  # until the client gives up or Simulator.stop() closes us
+                if roll < self.hang_rate + self.drop_rate:
+                    return
+                if roll < self.hang_rate + self.drop_rate + self.error_rate:
+                    status, content_type, body = 503, "text/plain", b""
+                else:
+                    status, content_type, body = self.handle(method, path)
+                close = headers.get("connection", "").lower() == "close"
+                writer.write((f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'OK')}\r\n"
+                              f"Content-Type: {content_type}\r\n"
+                              f"Content-Length: {len(body)}\r\n"
+                              f"Connection: {'close' if close else 'keep-alive'}\r\n"
+                              f"\r\n").encode("latin-1") + body)
+                await writer.drain()
+                if close:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+
+class Simulator(object):
+    """
+    A fleet of VirtualTVs. With per_port=False TV i listens on host + i
+    (the next loopback address) at port 8060; with per_port=True on host at
+    port + i. Extra keyword arguments are passed to every VirtualTV.
+    """
+    def __init__(self, count, host="127.0.1.1", port=ECP_PORT, per_port=False,
+                 catalog_size=len(KNOWN_APPS), **tv_options):
+        apps = make_catalog(catalog_size)
+        icons = _load_icons()
+        first = ipaddress.ip_address(host)
+        self.tvs = []
+        for i in range(count):
+            tv_host, tv_port = (host, port + i) if per_port else (str(first + i), port)
+            self.tvs.append(VirtualTV(i + 1, tv_host, tv_port, apps=apps, icons=icons,
+                                      **tv_options))
+        self._servers = []
+        self._loop = None
+
+    @property
+    def addresses(self):
+        return [tv.address for tv in self.tvs]
+
+    def env_lines(self):
+        """.env lines configuring the kiosk/admin for every simulated TV."""
+        return [f"TV{tv.number:02d}_IP={tv.address}" for tv in self.tvs]
+
+    async def start(self):
+        for tv in self.tvs:
+            server = await asyncio.start_server(tv.serve_connection, tv.host, tv.port,
+                                                reuse_address=True)
+            self._servers.append(server)
+        return self
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+        for tv in self.tvs:
+            for writer in list(tv.writers):
+                writer.close()
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    def start_in_thread(self):
+        """Serve from a daemon thread with its own loop; returns once every TV is listening."""
+        started = threading.Event()
+        errors = []
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self.start())
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+        threading.Thread(target=run, name="ecp-simulator", daemon=True).start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def stop_thread(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result(10)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Roku TVs speaking ECP.")
+    parser.add_argument("--count", type=int, default=2, help="number of TVs")
+    parser.add_argument("--host", default="127.0.1.1",
+                        help="address of the first TV (later TVs use the next addresses)")
+    parser.add_argument("--port", type=int, default=ECP_PORT)
+    parser.add_argument("--per-port", action="store_true",
+                        help="put every TV on --host, at consecutive ports from --port")
+    parser.add_argument("--apps", type=int, default=len(KNOWN_APPS), help="apps per TV")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of latency")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="fraction of connections closed without an answer")
+    parser.add_argument("--hang-rate", type=float, default=0.0,
+                        help="fraction of requests never answered")
+    parser.add_argument("--env", action="store_true", help="print TVnn_IP lines for .env")
+    args = parser.parse_args()
+
+    simulator = Simulator(args.count, args.host, args.port, per_port=args.per_port,
+                          catalog_size=args.apps, latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, drop_rate=args.drop_rate,
+                          hang_rate=args.hang_rate)
+    async def run():
+        await simulator.start()
+        print(f"Simulating {args.count} TVs: {simulator.addresses[0]} ... {simulator.addresses[-1]}")
+        if args.env:
+            print("\n".join(simulator.env_lines()))
+        start = time.monotonic()
+        while True:
+            await asyncio.sleep(60)
+            total = sum(tv.requests for tv in simulator.tvs)
+            print(f"{total} requests in {time.monotonic() - start:.0f}s")
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,59 @@
 #!/usr/bin/env python3
+import time
+STARTUP_T0 = time.perf_counter()
+STARTUP_PHASES = []  # (phase, seconds since STARTUP_T0); printed when STARTUP_TIMING=1
+
+def mark_startup(phase):
+    """Record that a startup phase has finished."""
+    STARTUP_PHASES.append((phase, time.perf_counter() - STARTUP_T0))
+
 import os
 os.environ['KIVY_NO_MULTITOUCH'] = '1'  # disable simulated multitouch
+
+# Load the .env file first so it can configure the window below. Use the file
+# next to this script directly rather than searching for it with find_dotenv.
+from dotenv import load_dotenv, find_dotenv
+dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+if not os.path.exists(dotenv_path):
+    dotenv_path = find_dotenv()
+print("Found .env file at:", dotenv_path)
+load_dotenv(dotenv_path, override=True)
+mark_startup("load .env")
+
 from kivy.config import Config
 Config.set('input', 'mouse', '')
 
-try:
-    from screeninfo import get_monitors
-    monitors = get_monitors()
-    if monitors:
-        monitor = monitors[0]
-        print(f"Monitor resolution: {monitor.width}x{monitor.height}")
-        if monitor.width <= 800 or monitor.height <= 480:
-            Config.set('graphics', 'fullscreen', 'auto')
-        else:
-            Config.set('graphics', 'width', '800')
-            Config.set('graphics', 'height', '480')
-            Config.set('graphics', 'fullscreen', '0')
+def use_window(fullscreen):
+    if fullscreen:
+        Config.set('graphics', 'fullscreen', 'auto')
     else:
         Config.set('graphics', 'width', '800')
         Config.set('graphics', 'height', '480')
         Config.set('graphics', 'fullscreen', '0')
-except ImportError:
-    print("screeninfo module not found. Using default window size 800x480.")
-    Config.set('graphics', 'width', '800')
-    Config.set('graphics', 'height', '480')
-    Config.set('graphics', 'fullscreen', '0')
 
-import os
-import requests
-import xml.etree.ElementTree as ET
+# KIOSK_FULLSCREEN=1/0 skips probing the monitor (which can be slow at boot).
+if os.environ.get("KIOSK_FULLSCREEN") in ("0", "1"):
+    use_window(os.environ["KIOSK_FULLSCREEN"] == "1")
+else:
+    try:
+        from screeninfo import get_monitors
+        monitors = get_monitors()
+        if monitors:
+            monitor = monitors[0]
+            print(f"Monitor resolution: {monitor.width}x{monitor.height}")
+            use_window(monitor.width <= 800 or monitor.height <= 480)
+        else:
+            use_window(False)
+    except ImportError:
+        print("screeninfo module not found. Using default window size 800x480.")
+        use_window(False)
+    except Exception as e:
+        print(f"Could not read monitor info ({e}). Using default window size 800x480.")
+        use_window(False)
+mark_startup("window config")
+
 import socket
 import sys
-import time
 import threading
 
 from kivy.app import App
@@ -43,60 +65,222 @@ from kivy.uix.label import Label
 from kivy.uix.image import Image
 from kivy.uix.button import Button  # original Button imported for fallback/reference
 from kivy.uix.behaviors import ButtonBehavior
+from kivy.core.image import Image as CoreImage
 
-from dotenv import load_dotenv, find_dotenv
-
-# Load the .env file.
-dotenv_path = find_dotenv()
-print("Found .env file at:", dotenv_path)
-load_dotenv(override=True)
+from ecp import metrics
+from ecp.config import EnvFile, configured_tvs, diff_env, is_tv_setting, tv_groups
+from ecp.debounce import AdaptiveDebouncer
+from ecp.discovery import get_registry
+from ecp.dispatcher import TextEntry, get_dispatcher
+from ecp.health import DEGRADED, OPEN, get_health
+from ecp.poller import get_poller
+mark_startup("imports")
 
 # Use a directory inside the user’s home directory to store icons.
-ICON_DIR = os.environ.get("ICON_DIR", os.path.join(os.path.expanduser("~"), "remote_control_icons"))
+# Older admin pages wrote ICON_DIR=None into .env, so treat that as unset too.
+ICON_DIR = os.environ.get("ICON_DIR", "").strip()
+if not ICON_DIR or ICON_DIR == "None":
+    ICON_DIR = os.path.join(os.path.expanduser("~"), "remote_control_icons")
 if not os.path.exists(ICON_DIR):
     os.makedirs(ICON_DIR)
 
-def get_icon(app_id, roku_ip):
+# Downloads icons in the background; duplicate requests share one fetch.
+_icon_loader = None
+
+def get_icon_loader():
     """
-    Try to load the app icon from a file. If not available, retrieve it from the Roku device.
-    The icon is saved as 'app<app_id>.png'
+    Return the IconLoader, creating it on first use. Only called on the UI
+    thread, after the first frame, so neither ecp.icons nor the icon index
+    scan is on the startup path.
     """
-    icon_path = os.path.join(ICON_DIR, f"app{app_id}.png")
-    
-    if os.path.exists(icon_path):
-        print(f"Loaded icon from file: {icon_path}")
-        return icon_path
-
-    # Build the URL to fetch the icon from the Roku device.
-    url = f"http://{roku_ip}:8060/query/icon/{app_id}"
-    print(f"Fetching icon from: {url}")
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(icon_path, 'wb') as file:
-            file.write(response.content)
-        print(f"Saved icon to file: {icon_path}")
-        return icon_path
-    else:
-        print("Icon failed to save")
-        return None
+    global _icon_loader
+    if _icon_loader is None:
+        from ecp.icons import IconLoader
+        _icon_loader = IconLoader(ICON_DIR)
+    return _icon_loader
+
+# Polled for changes so edits from the admin page apply without pressing "Reload Env".
+env_file = EnvFile(dotenv_path)
+try:
+    ENV_WATCH_INTERVAL = float(os.environ.get("ENV_WATCH_INTERVAL", 2))
+except ValueError:
+    ENV_WATCH_INTERVAL = 2
+
+# Port the admin server listens on, shown on the kiosk next to its IP.
+try:
+    ADMIN_PORT = int(os.environ.get("ADMIN_PORT", 9000))
+except ValueError:
+    ADMIN_PORT = 9000
+
+# Shown while an icon is downloading, or if it can't be fetched. Ships with Kivy.
+PLACEHOLDER_ICON = "atlas://data/images/defaulttheme/button"
+
+# TV selector colours by the health of the TVs it points at (see ecp/health.py).
+TV_BUTTON_COLORS = {OPEN: (1, 0.3, 0.3, 1), DEGRADED: (1, 0.8, 0.3, 1), None: (1, 1, 1, 1)}
+
+# Press feedback: a button is tinted while its command is in flight, then by the outcome.
+ACK_PENDING, ACK_OK, ACK_FAILED = "pending", "acknowledged", "failed"
+ACK_COLORS = {ACK_PENDING: (0.5, 0.7, 1, 1), ACK_OK: (0.4, 1, 0.4, 1), ACK_FAILED: (1, 0.3, 0.3, 1)}
+ACK_HOLD = 1.0  # seconds the outcome tint stays before the button goes back to normal
+
+def report_startup():
+    """Print how long each startup phase took, if STARTUP_TIMING=1."""
+    if os.environ.get("STARTUP_TIMING") != "1":
+        return
+    print("Startup timing (seconds since launch):")
+    previous = 0.0
+    for phase, elapsed in STARTUP_PHASES:
+        print(f"  {phase:<20} {elapsed:7.3f}  (+{elapsed - previous:.3f})")
+        previous = elapsed
+
+def start_admin_server():
+    """
+    Import and run the Flask admin app from admin/ in a daemon thread.
+    ADMIN_SERVER picks the server (see admin/server.py); the default is a bounded worker pool.
+    """
+    def run_flask():
+        from admin import app as flask_app
+        from admin.server import serve
+        serve(flask_app, port=ADMIN_PORT)
+
+    flask_thread = threading.Thread(target=run_flask)
+    flask_thread.daemon = True  # This thread will exit when the main thread exits.
+    flask_thread.start()
+
+class TextureCache(object):
+    """
+    Decoded icon textures keyed by (tv_ip, app_id), shared by every icon widget.
+    Switching TVs then just swaps textures that are already on the GPU instead of
+    decoding the PNGs from disk again. A texture is reloaded only when its file
+    changes (e.g. after the icon cache revalidated it).
+    """
+    def __init__(self):
+        self._textures = {}  # (tv_ip, app_id) -> (path, mtime, texture)
+        self.lookups = metrics.counter("icon_texture_lookups_total",
+                                       "Decoded icon texture lookups, by result.", ("result",))
+
+    def get(self, tv_ip, app_id):
+        """Return the cached texture without touching the disk, or None."""
+        entry = self._textures.get((tv_ip, app_id))
+        self.lookups.inc(result="hit" if entry is not None else "miss")
+        return entry[2] if entry is not None else None
+
+    def load(self, tv_ip, app_id, path):
+        """Return the texture for path, decoding it only if it is new or has changed."""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        entry = self._textures.get((tv_ip, app_id))
+        if entry is not None and entry[:2] == (path, mtime):
+            return entry[2]
+        try:
+            texture = CoreImage(path, nocache=True).texture
+        except Exception as e:
+            print(f"Failed to decode icon {path}: {e}")
+            return None
+        self._textures[(tv_ip, app_id)] = (path, mtime, texture)
+        return texture
+
+icon_textures = TextureCache()
 
 # ----------------------------------------------------------------------
 # Debounced Button Classes
 # ----------------------------------------------------------------------
-class DebouncedButton(Button):
-    debounce_interval = 0.3  # seconds
-    def __init__(self, **kwargs):
+class AckFeedback(object):
+    """
+    Mixin for widgets that send ECP commands: tints the widget as soon as its
+    command is queued (pending), then green or red once the TV has answered,
+    so it's obvious whether a press reached the TV. Only the latest press on
+    a widget is shown; answers to earlier ones are ignored.
+    """
+    ack_property = "background_color"  # what gets tinted
+    _ack_serial = 0
+    _ack_reset = None
+    _ack_rest = None
+
+    def begin_ack(self):
+        """Show a command as pending; returns the token to pass to end_ack."""
+        if self._ack_rest is None:
+            self._ack_rest = tuple(getattr(self, self.ack_property))
+        self._ack_serial += 1
+        self._set_ack(ACK_PENDING)
+        return self._ack_serial
+
+    def end_ack(self, token, ok):
+        if token == self._ack_serial:
+            self._set_ack(ACK_OK if ok else ACK_FAILED)
+            self._ack_reset = Clock.schedule_once(lambda dt: self._clear_ack(token), ACK_HOLD)
+
+    def _set_ack(self, state):
+        if self._ack_reset is not None:
+            self._ack_reset.cancel()
+            self._ack_reset = None
+        setattr(self, self.ack_property, ACK_COLORS[state])
+
+    def _clear_ack(self, token):
+        if token == self._ack_serial:
+            setattr(self, self.ack_property, self._ack_rest)
+
+tap_debouncer = AdaptiveDebouncer()
+
+class DebouncedButton(AckFeedback, Button):
+    debouncer = tap_debouncer
+    def __init__(self, debounce_key=None, **kwargs):
         super(DebouncedButton, self).__init__(**kwargs)
-        self._last_release_time = 0
-    def on_release(self):
-        current_time = time.time()
-        if current_time - self._last_release_time < self.debounce_interval:
-            return  # Ignore this event if it comes too soon
-        self._last_release_time = current_time
-        super(DebouncedButton, self).on_release()
-
-class DebouncedAppIcon(ButtonBehavior, Image):
-    debounce_interval = 0.3  # seconds
+        self.debounce_key = debounce_key  # defaults to the button's text
+    def dispatch(self, event_type, *args, **kwargs):
+        # Handlers bound with bind(on_release=...) run before the on_release
+        # method, so a bounce has to be stopped here to keep them from firing.
+        if event_type == "on_release" and not self.debouncer.accept(self.debounce_key or self.text):
+            return True  # Ignore this event if it comes too soon
+        return super(DebouncedButton, self).dispatch(event_type, *args, **kwargs)
+
+class HoldButton(AckFeedback, Button):
+    """
+    D-pad button that holds the key down on the TV for as long as it is touched.
+    Sends /keydown/<key> on press and /keyup/<key> on release, so the TV does its
+    own native key repeat instead of us sending one keypress per tap.
+    """
+    max_hold = 10  # seconds; safety keyup in case the release never arrives
+    # D-pad taps are the main way around the TV, so only filter double-fires.
+    debouncer = AdaptiveDebouncer(max_interval=0.08)
+    def __init__(self, key, remote, **kwargs):
+        super(HoldButton, self).__init__(**kwargs)
+        self.key = key
+        self.remote = remote
+        self._held_tvs = None
+        self._hold_timeout = None
+
+    def on_press(self):
+        if not self.debouncer.accept(self.key):
+            return  # a touchscreen double-fire; the earlier press was already sent
+        self.release_key()  # never leave an earlier press held down
+        self._held_tvs = list(self.remote.active_tvs)
+        self.remote.send_keydown(self.key, self._held_tvs, source=self)
+        self._hold_timeout = Clock.schedule_once(lambda dt: self.release_key(), self.max_hold)
+
+    def _do_release(self, *args):
+        # Called on every touch up, including touches that slid off the button
+        # and never produce on_release, so this is where the keyup must go.
+        super(HoldButton, self)._do_release(*args)
+        self.release_key()
+
+    def on_disabled(self, instance, value):
+        if value:
+            self.release_key()
+
+    def release_key(self):
+        """Send the keyup for a held key, if any. Safe to call repeatedly."""
+        if self._hold_timeout is not None:
+            self._hold_timeout.cancel()
+            self._hold_timeout = None
+        if self._held_tvs is not None:
+            tv_ips, self._held_tvs = self._held_tvs, None
+            self.remote.send_keyup(self.key, tv_ips)
+
+class DebouncedAppIcon(AckFeedback, ButtonBehavior, Image):
+    ack_property = "color"
     def __init__(self, app_id, remote, **kwargs):
         kwargs.setdefault("allow_stretch", True)
         kwargs.setdefault("keep_ratio", True)
@@ -104,22 +288,48 @@ class DebouncedAppIcon(ButtonBehavior, Image):
         super(DebouncedAppIcon, self).__init__(**kwargs)
         self.app_id = app_id
         self.remote = remote
-        self._last_release_time = 0
-        self.update_icon()
+        # The real icon is shown by update_icon() once startup has finished.
+        self.source = PLACEHOLDER_ICON
 
     def update_icon(self):
-        icon_path = get_icon(self.app_id, self.remote.active_tv)
+        """Show the icon for the current app/TV, fetching it in the background if needed."""
+        app_id, tv_ip = self.app_id, self.remote.active_tv
+        texture = icon_textures.get(tv_ip, app_id)
+        if texture is None:
+            icon_path = get_icon_loader().cached(app_id, tv_ip)
+            if icon_path:
+                texture = icon_textures.load(tv_ip, app_id, icon_path)
+        if texture is not None:
+            self.show_texture(texture)
+            return
+        self.source = PLACEHOLDER_ICON
+        self.preload(tv_ip)
+
+    def preload(self, tv_ip):
+        """Fetch and decode this app's icon for tv_ip so it is ready before it is shown."""
+        app_id = self.app_id
+        def on_loaded(path):
+            Clock.schedule_once(lambda dt: self.icon_loaded(app_id, tv_ip, path))
+        get_icon_loader().load(app_id, tv_ip, on_loaded)
+
+    def icon_loaded(self, app_id, tv_ip, icon_path):
         if not icon_path:
-            icon_path = "fallback.png"
-        self.source = icon_path
-        self.reload()
+            return
+        texture = icon_textures.load(tv_ip, app_id, icon_path)
+        if (app_id, tv_ip) != (self.app_id, self.remote.active_tv):
+            return  # Cached for later; the app or TV changed while this was loading.
+        if texture is not None:
+            self.show_texture(texture)
+
+    def show_texture(self, texture):
+        # Clearing source first stops Image from reloading the placeholder over us.
+        self.source = ""
+        self.texture = texture
 
     def on_release(self):
-        current_time = time.time()
-        if current_time - self._last_release_time < self.debounce_interval:
+        if not tap_debouncer.accept(f"launch/{self.app_id}"):
             return  # Skip duplicate release events.
-        self._last_release_time = current_time
-        self.remote.launch_app(self.app_id)
+        self.remote.launch_app(self.app_id, source=self)
 
 # ----------------------------------------------------------------------
 # PinPad class for on-screen PIN entry (with debounced buttons)
@@ -186,26 +396,192 @@ class PinPad(Popup):
         self.callback(self.entered_pin)
         self.dismiss()
 
+# ----------------------------------------------------------------------
+# TextPad class for typing into search boxes on the TV
+# ----------------------------------------------------------------------
+class KeyButton(DebouncedButton):
+    # Only drop touchscreen double-fires, so doubled letters ("ll") type fine.
+    debouncer = AdaptiveDebouncer(max_interval=0.08)
+
+class TextPad(Popup):
+    """
+    On-screen keyboard. The text is typed on the TV in one go when Send is
+    pressed (as Lit_ keypresses, see ecp.dispatcher.TextEntry), instead of
+    steering the TV's own on-screen keyboard one arrow press at a time.
+    """
+    rows = ["1234567890", "qwertyuiop", "asdfghjkl", "zxcvbnm"]
+    def __init__(self, callback, **kwargs):
+        super(TextPad, self).__init__(**kwargs)
+        self.title = "Type on TV"
+        self.size_hint = (0.9, 0.9)
+        self.callback = callback
+        self.entered_text = ""
+
+        main_layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
+
+        # Display area (shows the text typed so far)
+        self.display_label = Label(text="_", font_size=32, halign="center", size_hint=(1, 0.15))
+        main_layout.add_widget(self.display_label)
+
+        # Rows of letter keys, then Space, Back and Clear.
+        keys_layout = BoxLayout(orientation='vertical', spacing=5, size_hint=(1, 0.65))
+        for row in self.rows:
+            row_layout = BoxLayout(spacing=5)
+            for char in row:
+                btn = KeyButton(text=char, font_size=24)
+                btn.bind(on_release=self.on_key_press)
+                row_layout.add_widget(btn)
+            keys_layout.add_widget(row_layout)
+        last_row = BoxLayout(spacing=5)
+        space_btn = KeyButton(text="Space", font_size=24, size_hint_x=3)
+        space_btn.bind(on_release=self.on_space)
+        last_row.add_widget(space_btn)
+        back_btn = KeyButton(text="Back", font_size=24)
+        back_btn.bind(on_release=self.on_back)
+        last_row.add_widget(back_btn)
+        clear_btn = DebouncedButton(text="Clear", font_size=24)
+        clear_btn.bind(on_release=self.on_clear)
+        last_row.add_widget(clear_btn)
+        keys_layout.add_widget(last_row)
+        main_layout.add_widget(keys_layout)
+
+        # Send and Cancel buttons at the bottom.
+        btn_layout = BoxLayout(size_hint=(1, 0.2), spacing=10)
+        send_btn = DebouncedButton(text="Send", font_size=24)
+        send_btn.bind(on_release=self.on_send)
+        cancel_btn = DebouncedButton(text="Cancel", font_size=24)
+        cancel_btn.bind(on_release=self.dismiss)
+        btn_layout.add_widget(send_btn)
+        btn_layout.add_widget(cancel_btn)
+        main_layout.add_widget(btn_layout)
+
+        self.content = main_layout
+
+    def on_key_press(self, instance):
+        self.entered_text += instance.text
+        self.update_display()
+
+    def on_space(self, instance):
+        self.entered_text += " "
+        self.update_display()
+
+    def on_back(self, instance):
+        self.entered_text = self.entered_text[:-1]
+        self.update_display()
+
+    def on_clear(self, instance):
+        self.entered_text = ""
+        self.update_display()
+
+    def update_display(self):
+        self.display_label.text = self.entered_text + "_"
+
+    def on_send(self, instance):
+        if self.entered_text:
+            self.callback(self.entered_text)
+        self.dismiss()
+
 # ----------------------------------------------------------------------
 # Main Application
 # ----------------------------------------------------------------------
 class RemoteControlApp(App):
+    def __init__(self, **kwargs):
+        super(RemoteControlApp, self).__init__(**kwargs)
+        # Callables run once the first frame is on screen (see finish_startup).
+        self.startup_hooks = []
+        self.local_ip = None
+        self.ack_text = ""   # outcome and round trip of the latest command, for the status line
+        self._ack_serial = 0
+
     def get_local_ip(self):
-        """Return the local IP address of the current device."""
+        """
+        Return the local IP address of the current device.
+        Reads the addresses of the network interfaces directly, so it never
+        waits on a route or DNS lookup.
+        """
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            # Using Google's public DNS server to determine the outgoing interface.
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except Exception:
-            return "127.0.0.1"
+            import fcntl
+            import struct
+            SIOCGIFADDR = 0x8915  # Linux
+            for _, name in socket.if_nameindex():
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR,
+                                         struct.pack('256s', name[:15].encode()))
+                    ip = socket.inet_ntoa(packed[20:24])
+                except OSError:
+                    continue  # interface has no IPv4 address
+                finally:
+                    s.close()
+                if not ip.startswith("127."):
+                    return ip
+        except (ImportError, AttributeError, OSError):
+            pass  # not Linux; fall back to the hostname
+        try:
+            for ip in socket.gethostbyname_ex(socket.gethostname())[2]:
+                if not ip.startswith("127."):
+                    return ip
+        except OSError:
+            pass
+        return "127.0.0.1"
+
+    def refresh_local_ip(self):
+        """Look up the local IP off the UI thread and update the label."""
+        def lookup():
+            ip = self.get_local_ip()
+            Clock.schedule_once(lambda dt: self.set_local_ip(ip))
+        threading.Thread(target=lookup, daemon=True).start()
+
+    def set_local_ip(self, ip):
+        self.local_ip = ip
+        self.update_status()
         
+    def load_tvs(self):
+        """
+        Read the TV list (TV01_IP ... TVnn_IP) and GROUP_<NAME> entries from the
+        environment and rebuild what the TV selector cycles through: each TV on
+        its own, then each group (commands to a group go to all its TVs at once).
+        """
+        self.tvs = configured_tvs(os.environ)
+        self.groups = tv_groups(os.environ, self.tvs)
+        self.targets = [(f"TV: {tv.number}", [tv.ip]) for tv in self.tvs]
+        if len(self.tvs) > 1:
+            for name, members in self.groups.items():
+                label = "All" if name == "all" else f"Group: {name}"
+                self.targets.append((label, [tv.ip for tv in members]))
+
+    def select_target(self, index):
+        """Make targets[index] the TV (or group of TVs) that commands go to."""
+        self.target_index = index % len(self.targets)
+        label, tv_ips = self.targets[self.target_index]
+        self.active_tvs = tv_ips
+        self.active_tv = tv_ips[0]  # icons and status follow the first TV
+        self.update_tv_button()
+
+    def update_tv_button(self):
+        """
+        Label the TV selector with the current target, marked (and coloured) if
+        any of its TVs is unreachable -- commands to them fail at once -- or slow.
+        """
+        if not hasattr(self, "tv_toggle_btn"):
+            return
+        label, tv_ips = self.targets[self.target_index]
+        health = get_health()
+        states = [health.state(tv_ip) for tv_ip in tv_ips]
+        down = states.count(OPEN)
+        if down:
+            label += "\n(unreachable)" if down == len(states) else f"\n({down} unreachable)"
+            worst = OPEN
+        else:
+            worst = DEGRADED if DEGRADED in states else None
+        self.tv_toggle_btn.text = label
+        self.tv_toggle_btn.halign = "center"
+        self.tv_toggle_btn.background_color = TV_BUTTON_COLORS[worst]
+
     def build(self):
         # Load configuration from environment variables.
-        self.tv1_ip = os.environ.get("TV01_IP", "10.24.10.23")
-        self.tv2_ip = os.environ.get("TV02_IP", "10.24.10.99")
+        self.env = env_file.load()  # what the running config was read from, for reload_env's diff
+        self.load_tvs()
         self.app1_id = os.environ.get("APP1_ID", "app1")
         self.app2_id = os.environ.get("APP2_ID", "app2")
         self.app3_id = os.environ.get("APP3_ID", "app3")
@@ -213,30 +589,33 @@ class RemoteControlApp(App):
         # Use a numeric admin PIN for the pinpad (default is "1234")
         self.admin_password = os.environ.get("ADMIN_PASSWORD", "1234")
 
-        self.active_tv = self.tv1_ip  # Start by controlling TV01.
-        self.admin_mode = False       # Admin mode is off by default.
+        self.select_target(0)     # Start by controlling TV01.
+        self.admin_mode = False   # Admin mode is off by default.
 
         # Main vertical layout.
         main_layout = BoxLayout(orientation='vertical')
 
         # Top bar: TV selector and invisible admin login trigger.
-        local_ip = self.get_local_ip()
-
         top_bar = BoxLayout(size_hint_y=0.1)
         # Left: TV toggle button.
-        self.tv_toggle_btn = DebouncedButton(text="TV: 1", size_hint_x=0.2)
+        # Its label changes with the target and TV health, so debounce it by a fixed key.
+        self.tv_toggle_btn = DebouncedButton(text=self.targets[0][0], debounce_key="tv_toggle",
+                                             size_hint_x=0.2)
         self.tv_toggle_btn.bind(on_release=self.toggle_tv)
-        # Center: Label showing the local IP and port.
+        self.update_tv_button()
+        # Center: Label showing the local IP and port, plus the active TV's current app.
+        # The IP is filled in after the first frame (see finish_startup).
         center_label = Label(
-            text=f"{local_ip}:9000",
+            text=f":{ADMIN_PORT}",
             color=(0.5, 0.5, 0.5, 1),
             size_hint_x=0.6
         )
         center_label.halign = "center"
         center_label.valign = "middle"
         center_label.bind(size=center_label.setter('text_size'))
+        self.center_label = center_label
         # Right: Invisible admin login button.
-        admin_btn = DebouncedButton(text="", background_color=(0, 0, 0, 0), size_hint_x=0.2)
+        admin_btn = DebouncedButton(text="", debounce_key="admin_login", background_color=(0, 0, 0, 0), size_hint_x=0.2)
         admin_btn.bind(on_release=self.show_admin_login)
         top_bar.add_widget(self.tv_toggle_btn)
         top_bar.add_widget(center_label)
@@ -244,24 +623,26 @@ class RemoteControlApp(App):
         main_layout.add_widget(top_bar)
 
         # Middle area: D-pad controls in a 3x3 grid.
+        # Arrow keys are held down on the TV while touched (see HoldButton).
         controls_layout = GridLayout(cols=3, rows=3, size_hint_y=0.6)
+        self.hold_buttons = []
         controls_layout.add_widget(Label())  # Top-left placeholder.
-        up_btn = DebouncedButton(text="Up")
-        up_btn.bind(on_release=lambda x: self.send_keypress("Up"))
+        up_btn = HoldButton(key="Up", remote=self, text="Up")
+        self.hold_buttons.append(up_btn)
         controls_layout.add_widget(up_btn)
         controls_layout.add_widget(Label())  # Top-right placeholder.
-        left_btn = DebouncedButton(text="Left")
-        left_btn.bind(on_release=lambda x: self.send_keypress("Left"))
+        left_btn = HoldButton(key="Left", remote=self, text="Left")
+        self.hold_buttons.append(left_btn)
         controls_layout.add_widget(left_btn)
         ok_btn = DebouncedButton(text="OK")
-        ok_btn.bind(on_release=lambda x: self.send_keypress("Select"))
+        ok_btn.bind(on_release=lambda x: self.send_keypress("Select", source=x))
         controls_layout.add_widget(ok_btn)
-        right_btn = DebouncedButton(text="Right")
-        right_btn.bind(on_release=lambda x: self.send_keypress("Right"))
+        right_btn = HoldButton(key="Right", remote=self, text="Right")
+        self.hold_buttons.append(right_btn)
         controls_layout.add_widget(right_btn)
         controls_layout.add_widget(Label())  # Bottom-left placeholder.
-        down_btn = DebouncedButton(text="Down")
-        down_btn.bind(on_release=lambda x: self.send_keypress("Down"))
+        down_btn = HoldButton(key="Down", remote=self, text="Down")
+        self.hold_buttons.append(down_btn)
         controls_layout.add_widget(down_btn)
         controls_layout.add_widget(Label())  # Bottom-right placeholder.
         main_layout.add_widget(controls_layout)
@@ -271,8 +652,12 @@ class RemoteControlApp(App):
 
         # Add the Back button into the same row.
         back_button = DebouncedButton(text="Back", size_hint=(None, 1), width=80)
-        back_button.bind(on_release=lambda x: self.send_keypress("Back"))
+        back_button.bind(on_release=lambda x: self.send_keypress("Back", source=x))
         apps_layout.add_widget(back_button)
+        # Keyboard for search boxes, typed on the TV in one go.
+        self.type_btn = DebouncedButton(text="Type", size_hint=(None, 1), width=80)
+        self.type_btn.bind(on_release=self.show_text_pad)
+        apps_layout.add_widget(self.type_btn)
 
         # Add the app icons next to the Back button.
         self.app_icons = []
@@ -289,16 +674,16 @@ class RemoteControlApp(App):
         self.admin_layout.opacity = 0
         self.admin_layout.disabled = True
         home_btn = DebouncedButton(text="Home")
-        home_btn.bind(on_release=lambda x: self.send_keypress("Home"))
+        home_btn.bind(on_release=lambda x: self.send_keypress("Home", source=x))
         self.admin_layout.add_widget(home_btn)
         vol_up_btn = DebouncedButton(text="Volume Up")
-        vol_up_btn.bind(on_release=lambda x: self.send_keypress("VolumeUp"))
+        vol_up_btn.bind(on_release=lambda x: self.send_keypress("VolumeUp", source=x))
         self.admin_layout.add_widget(vol_up_btn)
         vol_down_btn = DebouncedButton(text="Volume Down")
-        vol_down_btn.bind(on_release=lambda x: self.send_keypress("VolumeDown"))
+        vol_down_btn.bind(on_release=lambda x: self.send_keypress("VolumeDown", source=x))
         self.admin_layout.add_widget(vol_down_btn)
         power_btn = DebouncedButton(text="Power")
-        power_btn.bind(on_release=lambda x: self.send_keypress("Power"))
+        power_btn.bind(on_release=lambda x: self.send_keypress("Power", source=x))
         self.admin_layout.add_widget(power_btn)
         # Button to reload the .env file.
         reload_btn = DebouncedButton(text="Reload Env")
@@ -310,22 +695,81 @@ class RemoteControlApp(App):
         self.admin_layout.add_widget(exit_btn)
         main_layout.add_widget(self.admin_layout)
 
+        mark_startup("build")
         return main_layout
 
+    def on_start(self):
+        # Anything not needed to draw the first frame waits until it is on screen.
+        from kivy.core.window import Window
+        def first_frame(*args):
+            Window.unbind(on_flip=first_frame)
+            mark_startup("first frame")
+            Clock.schedule_once(lambda dt: self.finish_startup())
+        Window.bind(on_flip=first_frame)
+
+    def finish_startup(self):
+        """Deferred startup work, run just after the first frame."""
+        self.refresh_local_ip()
+        # Follow TVs that DHCP moves to a new address.
+        registry = get_registry()
+        registry.add_listener(lambda serial, old_ip, new_ip: Clock.schedule_once(
+            lambda dt: self.on_tv_moved(old_ip, new_ip)))
+        registry.start()
+        # TV state comes from the shared background poller; the label only reads its cache.
+        get_poller().track("kiosk", [tv.ip for tv in self.tvs])
+        Clock.schedule_interval(lambda dt: self.update_status(), 1)
+        # Mark the TV selector when a TV stops (or starts) answering.
+        get_health().add_listener(lambda tv_ip, health: Clock.schedule_once(
+            lambda dt: self.update_tv_button()))
+        if ENV_WATCH_INTERVAL > 0:
+            Clock.schedule_interval(lambda dt: self.check_env(), ENV_WATCH_INTERVAL)
+        for icon in self.app_icons:
+            icon.update_icon()
+        # Warm the texture cache for the other TV too, so the first switch is instant.
+        self.preload_icons()
+        for hook in self.startup_hooks:
+            hook()
+        mark_startup("deferred startup")
+        report_startup()
+        if os.environ.get("STARTUP_EXIT") == "1":
+            self.stop()  # for benchmarking startup (bench/run.py)
+
+    def on_tv_moved(self, old_ip, new_ip):
+        """A configured TV was rediscovered at a new address; point everything at it."""
+        if old_ip not in [tv.ip for tv in self.tvs]:
+            return
+        self.load_tvs()  # the registry now resolves the TV to new_ip
+        self.select_target(self.target_index)
+        for icon in self.app_icons:
+            icon.update_icon()
+        get_poller().track("kiosk", [tv.ip for tv in self.tvs])
+
+    def preload_icons(self):
+        """Fetch and decode every app icon for every TV in the background."""
+        for tv in self.tvs:
+            for icon in self.app_icons:
+                icon.preload(tv.ip)
+
+    def update_status(self):
+        """Show the active TV's current app (from the poller cache) next to the admin URL."""
+        active = get_poller().cache.value(self.active_tv, "active_app")
+        text = f"{self.local_ip or ''}:{ADMIN_PORT}"
+        if active is not None and active.name:
+            text += f"  |  {active.name}"
+        if self.ack_text:
+            text += f"  |  {self.ack_text}"
+        self.center_label.text = text
+
     def toggle_tv(self, instance):
-        """Switch between TV01 and TV02 and update app icons (only available in admin mode)."""
+        """Cycle through the TVs, then the TV groups, and update app icons (only available in admin mode)."""
         if not self.admin_mode:
             print("TV toggle is locked. Unlock admin mode to change the active TV.")
             return
-        if self.active_tv == self.tv1_ip:
-            self.active_tv = self.tv2_ip
-            self.tv_toggle_btn.text = "TV: 2"
-        else:
-            self.active_tv = self.tv1_ip
-            self.tv_toggle_btn.text = "TV: 1"
+        self.select_target(self.target_index + 1)
         # Update the app icons.
         for icon in self.app_icons:
             icon.update_icon()
+        self.update_status()
 
     def show_admin_login(self, instance):
         """Display the PIN pad popup to enter the admin PIN."""
@@ -341,6 +785,12 @@ class RemoteControlApp(App):
         # Delay opening the popup to avoid event leakage.
         Clock.schedule_once(lambda dt: pinpad.open(), 0.05)
 
+    def show_text_pad(self, instance):
+        """Display the keyboard popup; what is typed there is sent to the active TV(s)."""
+        text_pad = TextPad(callback=lambda text: self.type_text(text, source=instance))
+        # Delay opening the popup to avoid event leakage.
+        Clock.schedule_once(lambda dt: text_pad.open(), 0.05)
+
     def toggle_admin_mode(self):
         """Toggle the visibility of admin controls."""
         self.admin_mode = not self.admin_mode
@@ -355,71 +805,186 @@ class RemoteControlApp(App):
         """Exit the application."""
         App.get_running_app().stop()
 
+    def check_env(self):
+        """Reload the .env file if it has changed on disk (a single stat when it hasn't)."""
+        if env_file.changed():
+            self.reload_env()
+
     def reload_env(self):
         """
-        Reload the .env file, update configuration values, and refresh app icons.
+        Reload the .env file and apply only what changed: the TV list is rebuilt
+        only if a TV or group setting changed, and only icons whose app ID changed
+        (or all of them, if the TVs changed) are refreshed.
         """
-        from dotenv import load_dotenv
-        load_dotenv(override=True)
+        old_env, self.env = self.env, env_file.load()
+        changed = diff_env(old_env, self.env)
+        if not changed:
+            print("Environment unchanged.")
+            return
+        load_dotenv(dotenv_path, override=True)
+        for key in changed - set(self.env):
+            os.environ.pop(key, None)  # removed from .env
+        print(f"Environment reloaded! Changed: {', '.join(sorted(changed))}")
+
         # Update configuration values from the reloaded .env file.
-        self.tv1_ip = os.environ.get("TV01_IP", "10.24.10.23")
-        self.tv2_ip = os.environ.get("TV02_IP", "10.24.10.99")
         self.app1_id = os.environ.get("APP1_ID", "app1")
         self.app2_id = os.environ.get("APP2_ID", "app2")
         self.app3_id = os.environ.get("APP3_ID", "app3")
         self.app4_id = os.environ.get("APP4_ID", "app4")
         self.admin_password = os.environ.get("ADMIN_PASSWORD", "1234")
-        print("Environment reloaded!")
+        tvs_changed = any(is_tv_setting(key) for key in changed)
+        if tvs_changed:
+            target_label = self.targets[self.target_index][0]
+            self.load_tvs()
+            labels = [label for label, _ in self.targets]
+            self.select_target(labels.index(target_label) if target_label in labels else 0)
+            get_poller().track("kiosk", [tv.ip for tv in self.tvs])
         
-        # Update the app icons with the new app IDs.
+        # Update the app icons whose app ID (or TV) changed.
         new_app_ids = [self.app1_id, self.app2_id, self.app3_id, self.app4_id]
         for i, icon in enumerate(self.app_icons):
-            if i < len(new_app_ids):
+            if i < len(new_app_ids) and (tvs_changed or icon.app_id != new_app_ids[i]):
                 icon.app_id = new_app_ids[i]
                 icon.update_icon()
+                for tv in self.tvs:
+                    icon.preload(tv.ip)
+
+    def track_ack(self, label, tv_ips, source=None):
+        """
+        Show a command as pending on the widget that sent it (source) and in the
+        status line, then as acknowledged with its round trip in ms -- the slowest
+        TV's, for a group -- or as failed, once every TV in tv_ips has answered.
+        Returns a callback for send_command's results.
+        """
+        self._ack_serial += 1
+        serial = self._ack_serial
+        token = source.begin_ack() if isinstance(source, AckFeedback) else None
+        results = []
+        self.set_ack_text(f"{label}: sending...")
+        def on_result(result):
+            results.append(result)
+            if len(results) < len(tv_ips):
+                return
+            failed = sum(1 for r in results if not r.ok)
+            if token is not None:
+                source.end_ack(token, not failed)
+            if serial != self._ack_serial:
+                return  # a newer command owns the status line
+            if failed:
+                self.set_ack_text(f"{label}: failed" if failed == len(results)
+                                  else f"{label}: failed on {failed} of {len(results)} TVs")
+            else:
+                rtt = max(r.latency for r in results) * 1000
+                self.set_ack_text(f"{label}: {rtt:.0f} ms")
+        return on_result
+
+    def set_ack_text(self, text):
+        self.ack_text = text
+        self.update_status()
 
-    def send_keypress(self, key):
+    def send_command(self, tv_ips, path, on_result, source=None, label=None):
         """
-        Send a key press command to the active TV via Roku's External Control API.
+        Queue an ECP command for one TV, or broadcast it to several in parallel.
+        Returns immediately; on_result is called with each TV's CommandResult on the UI thread.
+        If label is given the command's progress is shown (see track_ack).
+        """
+        if isinstance(tv_ips, str):
+            tv_ips = [tv_ips]
+        # Two TV entries can share an IP; the dispatcher sends it one command, so
+        # expect one result per IP.
+        tv_ips = list(dict.fromkeys(tv_ips))
+        if label is not None:
+            ack = self.track_ack(label, tv_ips, source)
+            report_result = on_result
+            def on_result(result):
+                report_result(result)
+                ack(result)
+        def deliver(result):
+            Clock.schedule_once(lambda dt: on_result(result))
+        dispatcher = get_dispatcher()
+        if len(tv_ips) == 1:
+            return dispatcher.submit(tv_ips[0], path, callback=deliver)
+        future = dispatcher.broadcast(tv_ips, path, callback=deliver)
+        def report(f):
+            results = f.result()
+            ok = sum(1 for result in results.values() if result.ok)
+            slowest = max(result.latency for result in results.values())
+            print(f"Broadcast '{path}': {ok}/{len(results)} TVs OK in {slowest * 1000:.0f} ms")
+        future.add_done_callback(report)
+        return future
+
+    def send_keypress(self, key, source=None):
+        """
+        Send a key press command to the active TV (or group of TVs) via Roku's External Control API.
         For example, to send an "Up" command, POST to:
         http://<TV_IP>:8060/keypress/Up
+        source is the widget pressed, which shows whether the TV acknowledged it.
         """
-        url = f"http://{self.active_tv}:8060/keypress/{key}"
-        try:
-            response = requests.post(url)
-            if response.status_code == 200:
-                print(f"Sent '{key}' to {self.active_tv}")
+        def on_result(result):
+            if result.error is not None:
+                print(f"Error sending '{key}' to {result.tv_ip}: {result.error}")
+            elif result.ok:
+                print(f"Sent '{key}' to {result.tv_ip}")
             else:
-                print(f"Failed to send '{key}' command, status: {response.status_code}")
-        except Exception as e:
-            print(f"Error sending '{key}': {e}")
-
-    def launch_app(self, app_id):
+                print(f"Failed to send '{key}' command to {result.tv_ip}, status: {result.status}")
+        self.send_command(self.active_tvs, f"keypress/{key}", on_result, source, key)
+
+    def send_keydown(self, key, tv_ips=None, source=None):
+        """Start holding a key on the active TV(s) (POST /keydown/<key>); pair with send_keyup."""
+        def on_result(result):
+            if not result.ok:
+                print(f"Failed to hold '{key}' on {result.tv_ip}: {result.error or result.status}")
+        self.send_command(tv_ips or self.active_tvs, f"keydown/{key}", on_result, source, key)
+
+    def send_keyup(self, key, tv_ips=None):
+        """Release a key held with send_keydown (POST /keyup/<key>)."""
+        def on_result(result):
+            if not result.ok:
+                print(f"Failed to release '{key}' on {result.tv_ip}: {result.error or result.status}")
+        self.send_command(tv_ips or self.active_tvs, f"keyup/{key}", on_result)
+
+    def launch_app(self, app_id, source=None):
         """
-        Launch an app on the active TV.
+        Launch an app on the active TV (or group of TVs).
         According to the API, you launch an app with:
         POST to /launch/<app_id>
         """
-        url = f"http://{self.active_tv}:8060/launch/{app_id}"
-        try:
-            response = requests.post(url)
-            if response.status_code == 200:
-                print(f"Launched app '{app_id}' on {self.active_tv}")
+        def on_result(result):
+            if result.error is not None:
+                print(f"Error launching app '{app_id}' on {result.tv_ip}: {result.error}")
+            elif result.ok:
+                print(f"Launched app '{app_id}' on {result.tv_ip}")
             else:
-                print(f"Failed to launch app '{app_id}', status: {response.status_code}")
-        except Exception as e:
-            print(f"Error launching app '{app_id}': {e}")
+                print(f"Failed to launch app '{app_id}' on {result.tv_ip}, status: {result.status}")
+        self.send_command(self.active_tvs, f"launch/{app_id}", on_result, source,
+                          f"Launch {app_id}")
 
-if __name__ == '__main__':
-    # Start the Flask app from admin.py in a separate thread.
-    from admin import app as flask_app
+    def type_text(self, text, source=None):
+        """
+        Type text into the focused text field (e.g. an app's search box) on the
+        active TV(s), as one Lit_<char> keypress per character streamed over a
+        kept-alive connection.
+        """
+        def on_result(result):
+            if result.ok:
+                print(f"Typed '{text}' on {result.tv_ip} in {result.latency * 1000:.0f} ms")
+            else:
+                print(f"Failed to type '{text}' on {result.tv_ip}: {result.error or result.status}")
+        self.send_command(self.active_tvs, TextEntry(text), on_result, source, f"Type '{text}'")
 
-    def run_flask():
-        flask_app.run(debug=True, use_reloader=False, host="0.0.0.0", port=9000)
+    def on_pause(self):
+        for btn in self.hold_buttons:
+            btn.release_key()
+        return True
 
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.daemon = True  # This thread will exit when the main thread exits.
-    flask_thread.start()
+    def on_stop(self):
+        for btn in self.hold_buttons:
+            btn.release_key()
+        get_dispatcher().stop()
+        get_poller().stop()
 
-    # Now run the Kivy app.
-    RemoteControlApp().run()
+if __name__ == '__main__':
+    # Run the Kivy app; the Flask admin server starts once the first frame is up.
+    app = RemoteControlApp()
+    app.startup_hooks.append(start_admin_server)
+    app.run()
@@ -0,0 +1,41 @@
+import unittest
+
+from ecp.debounce import AdaptiveDebouncer
+
+
+def accepted(debouncer, times, key="Right"):
+    """Feed releases at the given times (seconds) and return which were accepted."""
+    return [debouncer.accept(key, now=t) for t in times]
+
+
+class AdaptiveDebouncerTest(unittest.TestCase):
+    def test_fast_taps_all_get_through(self):
+        for spacing in (0.1, 0.15, 0.2, 0.3):
+            taps = [i * spacing for i in range(5)]
+            self.assertEqual(accepted(AdaptiveDebouncer(), taps), [True] * 5, spacing)
+
+    def test_double_fires_are_dropped(self):
+        # Five taps 150 ms apart, each reported twice 30 ms apart.
+        releases = sorted([i * 0.15 for i in range(5)] + [i * 0.15 + 0.03 for i in range(5)])
+        self.assertEqual(accepted(AdaptiveDebouncer(), releases), [True, False] * 5)
+
+    def test_slow_bounce_after_slow_taps_is_dropped(self):
+        # A slow tapper's bounce lands 150 ms after the tap, past min_interval.
+        self.assertEqual(accepted(AdaptiveDebouncer(), [0.0, 1.0, 2.0, 2.15, 3.0]),
+                         [True, True, True, False, True])
+
+    def test_keys_are_independent(self):
+        debouncer = AdaptiveDebouncer()
+        self.assertTrue(debouncer.accept("Up", now=0.0))
+        self.assertTrue(debouncer.accept("Down", now=0.01))
+        self.assertFalse(debouncer.accept("Up", now=0.02))
+
+    def test_fixed_window(self):
+        # KeyButton and HoldButton only filter double-fires.
+        debouncer = AdaptiveDebouncer(max_interval=0.08)
+        self.assertEqual(accepted(debouncer, [0.0, 1.0, 2.0, 2.09, 2.12]),
+                         [True, True, True, True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()